@@ -123,3 +123,57 @@ CELERY_TASK_TIME_LIMIT = 30 * 60
 CELERY_RESULT_BACKEND = "django-db"
 CELERY_CACHE_BACKEND = "django-cache"
 CELERY_BROKER_URL = os.getenv("REDIS_URI", "redis://127.0.0.1:6379")
+
+# Crawler related settings
+# number of new commits written to the database in one transaction
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "1000"))
+# number of processes that compute commit stats when indexing a large repo,
+# commits are split into ranges of INDEX_BATCH_SIZE commits
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", "1"))
+# number of processes that analyze local repositories in analyze_all_repositories
+ANALYZE_WORKERS = int(os.getenv("ANALYZE_WORKERS", "1"))
+# engine that counts the lines added and removed by each commit, either
+# "pydriller", which diffs every modified file in python, or "numstat",
+# which parses the output of a single git log --numstat process
+COMMIT_STATS_ENGINE = os.getenv("COMMIT_STATS_ENGINE", "pydriller")
+# count lines of code of modified files with the numstat engine,
+# this reads every modified file and costs most of the time saved
+COMMIT_STATS_NLOC = os.getenv("COMMIT_STATS_NLOC", "") == "1"
+# sqlite file caching the modified files of every commit by sha, shared by
+# the analyzer and the indexer. set to an empty string to disable the cache
+COMMIT_CACHE_PATH = os.getenv(
+    "COMMIT_CACHE_PATH", os.path.join(BASE_DIR, "commit_cache.sqlite3")
+)
+# directory of the bare mirrors of remote repositories, see stats/mirror.py
+GIT_MIRROR_DIR = os.getenv("GIT_MIRROR_DIR", os.path.join(BASE_DIR, "mirrors"))
+# number of crawler.ini sections discovered at the same time, and number
+# of concurrent requests sent to any one git server during discovery
+DISCOVER_WORKERS = int(os.getenv("DISCOVER_WORKERS", "8"))
+DISCOVER_HOST_CONCURRENCY = int(os.getenv("DISCOVER_HOST_CONCURRENCY", "2"))
+# sqlite file caching the responses of the git server APIs during discovery,
+# revalidated with conditional requests. set to an empty string to disable
+HTTP_CACHE_PATH = os.getenv(
+    "HTTP_CACHE_PATH", os.path.join(BASE_DIR, "http_cache.sqlite3")
+)
+# longest a discovery request waits for a rate limit to reset, in seconds
+DISCOVER_RATE_LIMIT_WAIT = int(os.getenv("DISCOVER_RATE_LIMIT_WAIT", "60"))
+# repos whose last indexing took longer than INDEX_LARGE_SECONDS, or that
+# were never indexed and store more than INDEX_LARGE_KIB of objects, are
+# sent to INDEX_LARGE_QUEUE, consumed by dedicated workers, so they don't
+# hold back the others
+INDEX_QUEUE = os.getenv("INDEX_QUEUE", "celery")
+INDEX_LARGE_QUEUE = os.getenv("INDEX_LARGE_QUEUE", "index_large")
+INDEX_LARGE_SECONDS = int(os.getenv("INDEX_LARGE_SECONDS", "120"))
+INDEX_LARGE_KIB = int(os.getenv("INDEX_LARGE_KIB", "102400"))
+# repos are indexed again between INDEX_INTERVAL and INDEX_MAX_INTERVAL
+# minutes later, backing off while they get no commits and never later
+# than INDEX_RECENCY_FACTOR times the mean time between their commits of
+# the last INDEX_RATE_DAYS days, or the age of their last commit when
+# there are none
+INDEX_INTERVAL = int(os.getenv("INDEX_INTERVAL", "5"))
+INDEX_MAX_INTERVAL = int(os.getenv("INDEX_MAX_INTERVAL", "10080"))
+INDEX_RECENCY_FACTOR = float(os.getenv("INDEX_RECENCY_FACTOR", "0.25"))
+INDEX_RATE_DAYS = int(os.getenv("INDEX_RATE_DAYS", "30"))
+# minutes a repo sent to the workers isn't sent again, unless its task
+# finished and scheduled it earlier
+INDEX_DISPATCH_LEASE = int(os.getenv("INDEX_DISPATCH_LEASE", "1440"))
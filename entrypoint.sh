@@ -33,6 +33,8 @@ fi
 
 if [ ! "$1" = "web" ]; then
   celery -A stats worker --beat --scheduler django --concurrency 2 &
+  # large repositories are indexed by their own worker, see INDEX_LARGE_QUEUE
+  celery -A stats worker -Q index_large -n large@%h --concurrency 1 --time-limit=7200 &
   flower -A stats --port=8001 &
 fi
 
@@ -0,0 +1,163 @@
+# query plans and timings of the hot queries on a generated dataset,
+# with and without the indexes added in migration 0010_indexes and the
+# index of plan_indexing
+#
+# needs postgres, configured with the PG_* environment variables used by
+# crawler/settings.py. the data is generated in a throwaway test database
+# that is dropped afterwards
+#
+# python scripts/bench_indexes.py [number of commits]
+#
+import os
+import sys
+import time
+
+import django
+
+# since this script sits in a subdirectory of the main django project
+# add django main project path to sys.path
+cwd = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(f"{cwd}/.."))
+
+REPOS = 2000
+AUTHORS = 20000
+
+GENERATE_SQL = [
+    """
+    insert into stats_authorstat
+        (lines_added, lines_removed, commit_count, merge_commit_count, last_status_at)
+    select 0, 0, 0, 0, '1970-01-01Z' from generate_series(1, %(authors)s)
+    """,
+    """
+    insert into stats_author (name, email, is_alias, stats_id, updated_at)
+    select 'dev' || i, 'dev' || i || '@example.com', false, i, now()
+    from generate_series(1, %(authors)s) i
+    """,
+    """
+    insert into stats_repository
+        (name, enabled, is_remote, status, last_status_at, last_commit_at,
+         next_index_at)
+    select 'group/repo' || i, i %% 20 <> 0, false,
+           case when i %% 50 = 0 then 'Error' else 'Ready' end,
+           now() - (i %% 1440) * interval '1 minute', '1970-01-01Z',
+           now() + (i %% 1440 - 60) * interval '1 minute'
+    from generate_series(1, %(repos)s) i
+    """,
+    """
+    insert into stats_commit
+        (sha, message, lines_added, lines_removed, lines_of_code, is_merge,
+         author_id, created_at, repo_id, indexed_at)
+    select md5(i::text) || substr(md5((-i)::text), 1, 8), 'some commit',
+           i %% 300, i %% 70, 0, i %% 10 = 0,
+           1 + i %% %(authors)s, now() - i * interval '17 seconds',
+           1 + i %% %(repos)s, now()
+    from generate_series(1, %(commits)s) i
+    """,
+    "analyze",
+]
+
+# the indexes added by 0010_indexes, dropped to show the plans without them
+INDEX_COLUMNS = [
+    ("stats_author", "email"),
+    ("stats_commit", "created_at"),
+    ("stats_repository", "name"),
+]
+INDEX_NAMES = ["stats_repo_due_idx"]
+CONSTRAINT_NAMES = [("stats_commit", "stats_commit_repo_sha_uniq")]
+
+
+def hot_queries():
+    from stats.models import Author, Commit, Repository
+
+    repo = Repository.objects.get(name="group/repo42")
+    sha = Commit.objects.filter(repo=repo).values_list("sha", flat=True).first()
+    return {
+        "author by email": Author.objects.filter(email="dev4242@example.com"),
+        "commit by repo and sha": Commit.objects.filter(repo=repo, sha=sha),
+        "commit hashes of repo": Commit.objects.filter(repo=repo).values_list("sha"),
+        "latest commits": Commit.objects.order_by("-created_at")[:100],
+        "latest commits of author": Commit.objects.filter(author_id=42).order_by(
+            "-created_at"
+        )[:100],
+        # same filter as plan_indexing
+        "repositories due for indexing": Repository.objects.filter(
+            status=Repository.RepoStatus.READY,
+            enabled=True,
+            next_index_at__lte=time_ago(0),
+        ),
+        "repository by name": Repository.objects.filter(name="group/repo1234"),
+    }
+
+
+def time_ago(minutes):
+    from datetime import datetime, timedelta
+
+    return datetime.now().astimezone() - timedelta(minutes=minutes)
+
+
+def run_queries(label):
+    print(f"\n==== {label} ====")
+    for name, queryset in hot_queries().items():
+        start = time.perf_counter()
+        list(queryset)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"\n--- {name}: {elapsed:.2f} ms")
+        print(queryset.explain(analyze=True))
+
+
+def drop_indexes(cur):
+    for table, column in INDEX_COLUMNS:
+        cur.execute(
+            """
+            select i.relname from pg_index x
+            join pg_class i on i.oid = x.indexrelid
+            join pg_class t on t.oid = x.indrelid
+            join pg_attribute a on a.attrelid = t.oid and a.attnum = x.indkey[0]
+            where t.relname = %s and a.attname = %s and x.indnatts = 1
+            """,
+            [table, column],
+        )
+        for (index,) in cur.fetchall():
+            cur.execute(f"drop index {index}")
+    for index in INDEX_NAMES:
+        cur.execute(f"drop index {index}")
+    for table, constraint in CONSTRAINT_NAMES:
+        cur.execute(f"alter table {table} drop constraint {constraint}")
+    cur.execute("analyze")
+
+
+def main(commits):
+    from django.db import connection, transaction
+
+    if connection.vendor != "postgresql":
+        print("this benchmark needs postgres")
+        sys.exit(1)
+
+    connection.settings_dict["TEST"]["NAME"] = "bench_gitcrawler"
+    db_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False
+    )
+    try:
+        params = {"commits": commits, "repos": REPOS, "authors": AUTHORS}
+        start = time.perf_counter()
+        with connection.cursor() as cur:
+            for sql in GENERATE_SQL:
+                cur.execute(sql, params)
+        print(f"generated {commits} commits in {time.perf_counter() - start:.1f}s")
+
+        run_queries("with indexes")
+
+        # postgres DDL is transactional, put the indexes back by rolling back
+        with transaction.atomic():
+            with connection.cursor() as cur:
+                drop_indexes(cur)
+            run_queries("without indexes")
+            transaction.set_rollback(True)
+    finally:
+        connection.creation.destroy_test_db(db_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "crawler.settings")
+    django.setup()
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3_000_000)
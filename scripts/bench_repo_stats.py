@@ -0,0 +1,107 @@
+# micro benchmark of accumulating analyzer stats over a stream of
+# modifications, nested dicts updated by incr() vs RepoStats
+#
+# python scripts/bench_repo_stats.py
+#
+import os
+import random
+import sys
+import timeit
+import tracemalloc
+
+# since this script sits in a subdirectory of the main django project
+# add django main project path to sys.path
+cwd = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(f"{cwd}/.."))
+
+from stats.analyzer import RepoStats  # noqa: E402
+
+
+def incr(stats, category, bucket, key="count", by=1):
+    """the accumulator before RepoStats"""
+    try:
+        my_dict = stats[category][bucket]
+    except KeyError:
+        my_dict = {}
+        stats[category][bucket] = my_dict
+
+    try:
+        my_dict[key] += by
+    except KeyError:
+        my_dict[key] = by
+
+
+def incr_stats(modifications):
+    stats = {"ext": {}, "base_path": {}, "commits": {}}
+    for is_merge, files in modifications:
+        incr(stats, "commits", "total")
+        if is_merge:
+            incr(stats, "commits", "merge")
+            continue
+        for base_path, ext, added, removed in files:
+            incr(stats, "base_path", base_path)
+            incr(stats, "ext", ext)
+            incr(stats, "ext", ext, "added", added)
+            incr(stats, "ext", ext, "removed", removed)
+    return stats
+
+
+def counter_stats(modifications):
+    stats = RepoStats()
+    for is_merge, files in modifications:
+        stats.add_commit(is_merge)
+        if is_merge:
+            continue
+        for base_path, ext, added, removed in files:
+            stats.add_file(base_path, ext, added, removed)
+    return stats
+
+
+def sample_commits(count):
+    """(is_merge, [(base_path, ext, added, removed)]) like a busy repo"""
+    random.seed(42)
+    paths = ["src", "web", "docs", "test", "/", "scripts", "deploy"]
+    paths += [f"module{i}" for i in range(200)]
+    exts = [".java", ".ts", ".go", ".md", ".py", ".yaml", ".xml", ""]
+    exts += [f".x{i}" for i in range(50)]
+    return [
+        (
+            random.random() < 0.1,
+            [
+                (
+                    random.choice(paths),
+                    random.choice(exts),
+                    random.randint(0, 200),
+                    random.randint(0, 100),
+                )
+                for _ in range(random.randint(1, 8))
+            ],
+        )
+        for _ in range(count)
+    ]
+
+
+def peak_memory(func, modifications):
+    tracemalloc.start()
+    func(modifications)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+if __name__ == "__main__":
+    commits = sample_commits(200_000)
+    files = sum(len(f) for is_merge, f in commits if not is_merge)
+    assert incr_stats(commits) == counter_stats(commits).to_dict()
+
+    # partial results of two workers add up to the whole
+    half = len(commits) // 2
+    merged = counter_stats(commits[:half]).merge(counter_stats(commits[half:]))
+    assert merged.to_dict() == incr_stats(commits)
+
+    for name, func in [("nested dict incr", incr_stats), ("RepoStats", counter_stats)]:
+        seconds = min(timeit.repeat(lambda: func(commits), number=1, repeat=3))
+        print(
+            f"{name:18} {seconds / files * 1e9:6.0f} ns/file"
+            f"  peak {peak_memory(func, commits) / 1024:6.0f} KiB"
+        )
@@ -4,7 +4,7 @@ from admin_interface.models import Theme
 from django.contrib import admin, messages
 from django.contrib.admin.templatetags.admin_urls import admin_urlname
 from django.contrib.auth.models import Group, User
-from django.db import models
+from django.db import models, transaction
 from django.forms import TextInput
 from django.shortcuts import resolve_url
 from django.utils.html import format_html
@@ -18,12 +18,23 @@ from django_celery_beat.models import (
 )
 from django_celery_results.models import TaskResult
 
-from .models import Author, AuthorAndStat, Commit, ConfigEntry, Job, Repository
+from .models import (
+    EPOCH_ZERO,
+    Author,
+    AuthorAndStat,
+    Commit,
+    ConfigEntry,
+    Job,
+    Repository,
+)
+from .scheduler import index_queue
 from .tasks import (
     discover_repositories,
     gather_author_stats,
     index_all_repositories,
     index_repository,
+    rebuild_author_rollups,
+    refresh_author_stats,
 )
 
 #
@@ -122,6 +133,18 @@ class AuthorAdmin(admin.ModelAdmin):
     def has_delete_permission(self, request, obj=None):
         return False
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # show the new tags in the author stats view
+        transaction.on_commit(refresh_author_stats.delay)
+        if {"is_alias", "original"} & set(form.changed_data):
+            # move the commits of the author to or from its original
+            author_ids = [obj.id, obj.original_id, form.initial.get("original")]
+            author_ids = [author_id for author_id in author_ids if author_id]
+            transaction.on_commit(
+                lambda: rebuild_author_rollups.delay(author_ids=author_ids)
+            )
+
 
 @admin.register(AuthorAndStat)
 class AuthorAndStatAdmin(admin.ModelAdmin):
@@ -231,6 +254,9 @@ class RepositoryAdmin(admin.ModelAdmin):
             status=Repository.RepoStatus.READY,
             last_error=None,
             last_status_at=datetime.now().astimezone(),
+            # index them on the next run, not when a failed run scheduled them
+            next_index_at=EPOCH_ZERO,
+            index_interval=None,
         )
         messages.success(request, "Selected repositories reset to Ready status")
 
@@ -238,7 +264,9 @@ class RepositoryAdmin(admin.ModelAdmin):
 
     def scan_action(self, request, queryset):
         for repo in queryset.all():
-            index_repository.delay(repo_id=repo.id)
+            index_repository.apply_async(
+                kwargs={"repo_id": repo.id}, queue=index_queue(repo)
+            )
         messages.success(request, "Selected repositories will be scanned shortly")
 
     scan_action.short_description = "Scan the selected repositories"
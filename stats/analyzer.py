@@ -1,40 +1,105 @@
 import json
 import os
+import time
+from collections import deque
+from textwrap import indent
 
+import billiard
+from django.conf import settings
 from git import GitCommandError
-from pydriller import ModificationType, RepositoryMining
+from pydriller import ModificationType
 
-from .utils import should_ignore_path
+from .commitcache import commit_cache
+from .gitrepo import FileChange, ReadOnlyGitRepository, head_commits, numstat_changes
+from .utils import ignore_matcher
 
 
-def get_repo_stats(repo_path):
-    repo_stats = {"ext": {}, "base_path": {}, "commits": {}}
+class RepoStats:
+    """
+    counts of the commits, file extensions and base paths of a repo's
+    modifications. each extension has a [count, added, removed] row
+    instead of a nested dict. stats of parts of a repo computed by
+    different workers are combined with merge()
+    """
+
+    def __init__(self):
+        self.total_commits = 0
+        self.merge_commits = 0
+        self.base_path = {}
+        self.ext = {}
+
+    def add_commit(self, is_merge: bool) -> None:
+        self.total_commits += 1
+        if is_merge:
+            self.merge_commits += 1
+
+    def add_file(self, base_path: str, ext: str, added: int, removed: int) -> None:
+        # plain dict.get is about twice as fast as Counter's __missing__
+        self.base_path[base_path] = self.base_path.get(base_path, 0) + 1
+        row = self.ext.get(ext)
+        if row is None:
+            row = self.ext[ext] = [0, 0, 0]
+        row[0] += 1
+        row[1] += added
+        row[2] += removed
+
+    def merge(self, other: "RepoStats") -> "RepoStats":
+        self.total_commits += other.total_commits
+        self.merge_commits += other.merge_commits
+        for base_path, count in other.base_path.items():
+            self.base_path[base_path] = self.base_path.get(base_path, 0) + count
+        for ext, other_row in other.ext.items():
+            row = self.ext.setdefault(ext, [0, 0, 0])
+            for i, value in enumerate(other_row):
+                row[i] += value
+        return self
+
+    def to_dict(self) -> dict:
+        """the nested {category: {bucket: {key: count}}} used in the reports"""
+        commits = {}
+        if self.total_commits:
+            commits["total"] = {"count": self.total_commits}
+        if self.merge_commits:
+            commits["merge"] = {"count": self.merge_commits}
+        return {
+            "commits": commits,
+            "base_path": {key: {"count": n} for key, n in self.base_path.items()},
+            "ext": {
+                ext: {"count": count, "added": added, "removed": removed}
+                for ext, (count, added, removed) in self.ext.items()
+            },
+        }
+
+
+def get_repo_stats(repo_path, ignore=None) -> RepoStats:
+    ignore = ignore or ignore_matcher()
+    repo_stats = RepoStats()
     print(f"get stats on repo {repo_path}")
 
+    git_repo = ReadOnlyGitRepository(repo_path)
     try:
-        for commit in RepositoryMining(repo_path).traverse_commits():
-            incr(repo_stats, "commits", "total")
+        shas = []
+        for sha, is_merge in head_commits(git_repo):
+            repo_stats.add_commit(is_merge)
+            if not is_merge:
+                shas.append(sha)
 
-            if commit.merge:
-                incr(repo_stats, "commits", "merge")
-                continue
-
-            for mod in commit.modifications:
+        # changes are shared with the indexer through the commit cache
+        for sha, changes, _ in commit_modifications(
+            git_repo, shas, workers=1, nloc=False
+        ):
+            for mod in changes:
                 file_path = mod.new_path
                 if file_path is None:
                     file_path = mod.old_path
 
-                if should_ignore_path(mod.filename):
+                if ignore.match(mod.filename):
                     continue
 
                 # file at root directory just use "/" as base_path
                 base_path = file_path.split("/")[0] if file_path.find("/") > 0 else "/"
-                incr(repo_stats, "base_path", base_path)
-
                 _, ext = os.path.splitext(mod.filename)
-                incr(repo_stats, "ext", ext)
-                incr(repo_stats, "ext", ext, "added", mod.added)
-                incr(repo_stats, "ext", ext, "removed", mod.added)
+                repo_stats.add_file(base_path, ext, mod.added, mod.removed)
 
                 if mod.change_type not in [
                     ModificationType.ADD,
@@ -43,70 +108,232 @@ def get_repo_stats(repo_path):
                     ModificationType.RENAME,
                 ]:
                     print(
-                        f"**** commit {commit.hash} of {repo_path}:{file_path} "
+                        f"**** commit {sha} of {repo_path}:{file_path} "
                         f"is weird change_type = {mod.change_type} ****"
                     )
     except GitCommandError as e:
         print(f"Exception get_repo_stats {repo_path} => {str(e)}\n{e}")
+    finally:
+        git_repo.clear()
 
     return repo_stats
 
 
-def analyze_all_repositories(report_file, conf=None):
+def analyze_all_repositories(
+    report_file, conf=None, resume=False, workers=None, progress=None
+):
     """
     run some stats on file path and extention on local repositories
-    to gather data on what files and path should be ignored
+    to gather data on what files and path should be ignored.
+    the stats of each repo are appended to {report_file}.ndjson as soon as
+    the repo is done and merged into {report_file}.json and .csv at the
+    end, so memory use doesn't grow with the number of repos. with resume
+    the repos already in the .ndjson file of an interrupted run are skipped.
+    repos are analyzed by a pool of ANALYZE_WORKERS processes, progress is
+    called with (done, total, estimated seconds left) after each repo.
+    returns the number of repos analyzed
     """
     # import here to avoid circular reference
-    from .indexer import enumerate_repositories_by_config
+    from .indexer import DEFAULT_CONFIG, enumerate_repositories_by_config
+    from .models import ConfigEntry
 
-    all_stats = {}
-    for is_remote, repo_info in enumerate_repositories_by_config(conf):
-        repo_path = repo_info["repo_url"]
-        if not is_remote:
-            all_stats[repo_path] = get_repo_stats(repo_path)
-    if report_file and len(report_file) > 3:
-        save_stats(all_stats, report_file)
-    return all_stats
+    conf = conf or ConfigEntry.get(DEFAULT_CONFIG)
+    has_report = report_file and len(report_file) > 3
+    partial_file = f"{report_file}.ndjson" if has_report else os.devnull
+    done = resume_partial_stats(partial_file) if resume and has_report else set()
+    # sections are passed to the workers as dict, SectionProxy can't be pickled
+    repos = [
+        (repo_info["repo_url"], dict(conf[repo_info["section"]]))
+        for is_remote, repo_info in enumerate_repositories_by_config(conf)
+        if not is_remote and repo_info["repo_url"] not in done
+    ]
 
+    start = time.monotonic()
+    count = 0
+    with open(partial_file, "a" if resume else "w") as out:
+        for repo_path, repo_stats in analyze_repositories(repos, workers):
+            out.write(json.dumps({"repo": repo_path, "stats": repo_stats}) + "\n")
+            out.flush()
+            count += 1
+            if progress:
+                elapsed = time.monotonic() - start
+                progress(count, len(repos), elapsed / count * (len(repos) - count))
+    if has_report:
+        merge_stats([partial_file], report_file)
+    return count
 
-def incr(stats, category, bucket, key="count", by=1):
-    try:
-        my_dict = stats[category][bucket]
-    except KeyError:
-        my_dict = {}
-        stats[category][bucket] = my_dict
 
-    try:
-        my_dict[key] += by
-    except KeyError:
-        my_dict[key] = by
-
-
-def save_stats(stats, file_name):
-    with open(f"{file_name}.json", "w") as f:
-        json.dump(stats, f, sort_keys=True, indent=4)
-
-    with open(f"{file_name}.csv", "w") as out_f:
-        out_f.write("bucket,repo,key,value\n")
-        for k1 in stats.keys():
-            for k2 in stats[k1].keys():
-                for k3 in stats[k1][k2].keys():
-                    for k4 in stats[k1][k2][k3]:
-                        path = os.path.basename(k1)
-                        line = f"{k2},{path},{k3},{k4},{stats[k1][k2][k3][k4]}"
-                        # print(line)
+def analyze_repositories(repos, workers=None):
+    """yield (repo_path, stats) for (repo_path, section) in repos, as they finish"""
+    workers = workers or settings.ANALYZE_WORKERS
+    if workers < 2 or len(repos) < 2:
+        yield from map(_analyze_repository, repos)
+        return
+    with process_pool(workers) as pool:
+        yield from pool.imap_unordered(_analyze_repository, repos)
+
+
+def _analyze_repository(repo):
+    repo_path, section = repo
+    return repo_path, get_repo_stats(repo_path, ignore_matcher(section)).to_dict()
+
+
+def process_pool(workers):
+    """
+    pool of worker processes. billiard is celery's fork of multiprocessing,
+    unlike concurrent.futures its pools can be started from within the
+    daemonic worker processes that run celery tasks
+    """
+    return billiard.Pool(processes=workers)
+
+
+def resume_partial_stats(partial_file):
+    """
+    return the repos in the partial stats file of an interrupted run,
+    dropping the last line if the run died while writing it
+    """
+    if not os.path.exists(partial_file):
+        return set()
+    with open(partial_file, "rb+") as f:
+        content = f.read()
+        if content and not content.endswith(b"\n"):
+            f.truncate(content.rfind(b"\n") + 1)
+    return {repo for repo, _ in read_partial_stats([partial_file])}
+
+
+def read_partial_stats(partial_files):
+    """yield (repo, stats) from partial stats files, one repo at a time"""
+    for partial_file in partial_files:
+        with open(partial_file) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"skipping incomplete line in {partial_file}")
+                    continue
+                yield entry["repo"], entry["stats"]
+
+
+def merge_stats(partial_files, file_name):
+    """
+    build the {file_name}.json and .csv reports from partial stats files,
+    streaming one repo at a time. a repo found in several files is only
+    reported once, from the first file
+    """
+    seen = set()
+    with open(f"{file_name}.json", "w") as f, open(f"{file_name}.csv", "w") as out_f:
+        f.write("{")
+        out_f.write("category,repo,bucket,key,value\n")
+        for k1, repo_stats in read_partial_stats(partial_files):
+            if k1 in seen:
+                continue
+            f.write(",\n" if seen else "\n")
+            seen.add(k1)
+            value = indent(json.dumps(repo_stats, sort_keys=True, indent=4), " " * 4)
+            f.write(f"    {json.dumps(k1)}: {value.lstrip()}")
+
+            path = os.path.basename(k1)
+            for k2 in repo_stats.keys():
+                for k3 in repo_stats[k2].keys():
+                    for k4 in repo_stats[k2][k3]:
+                        line = f"{k2},{path},{k3},{k4},{repo_stats[k2][k3][k4]}"
                         out_f.write(line + "\n")
+        f.write("\n}\n")
+
+
+def commit_modifications(git_repo, shas, engine=None, workers=None, nloc=None):
+    """
+    yield (sha, [FileChange], commit) for each of the commits, in the same
+    order, computed by the engine selected with COMMIT_STATS_ENGINE. commit
+    is the pydriller Commit when the engine loaded it, None otherwise. commits
+    found in the commit cache are not computed again. with more than one
+    worker the commits are split into ranges that are processed by a
+    pool of processes. lines of code are counted when nloc is True, by
+    default with COMMIT_STATS_NLOC and always by the pydriller engine
+    """
+    engine = engine or settings.COMMIT_STATS_ENGINE
+    workers = workers or settings.INDEX_WORKERS
+    if nloc is None:
+        nloc = settings.COMMIT_STATS_NLOC or engine == "pydriller"
+    cache = commit_cache()
+    if cache is None:
+        yield from _compute_modifications(git_repo, shas, engine, workers, nloc)
+        return
+
+    known = cache.known(shas, engine, nloc)
+    missing = [sha for sha in shas if sha not in known]
+    computed = _compute_modifications(git_repo, missing, engine, workers, nloc)
+    chunk_size = settings.INDEX_BATCH_SIZE
+    for i in range(0, len(shas), chunk_size):
+        chunk = shas[i : i + chunk_size]
+        cached = cache.get_many([sha for sha in chunk if sha in known], engine, nloc)
+        new_entries = []
+        for sha in chunk:
+            if sha in cached:
+                yield sha, cached[sha], None
+            else:
+                _, changes, commit = next(computed)
+                new_entries.append((sha, changes))
+                yield sha, changes, commit
+        cache.put_many(new_entries, engine, nloc)
+
+
+def _compute_modifications(git_repo, shas, engine, workers, nloc):
+    chunk_size = settings.INDEX_BATCH_SIZE
+    if workers < 2 or len(shas) <= chunk_size:
+        yield from _commit_modifications(git_repo, shas, engine, nloc)
+        return
+
+    with process_pool(workers) as pool:
+        # keep a few ranges in flight so results don't pile up in memory
+        # when the database writes can't keep up
+        pending = deque()
+        for i in range(0, len(shas), chunk_size):
+            chunk = shas[i : i + chunk_size]
+            args = (str(git_repo.path), chunk, engine, nloc)
+            pending.append(pool.apply_async(_chunk_modifications, args))
+            if len(pending) > workers * 2:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+def _commit_modifications(git_repo, shas, engine, nloc):
+    if engine == "numstat":
+        for sha, changes in numstat_changes(git_repo, shas, nloc=nloc):
+            yield sha, changes, None
+    elif engine == "pydriller":
+        for sha in shas:
+            commit = git_repo.get_commit(sha)
+            changes = [
+                FileChange.from_modification(mod, nloc) for mod in commit.modifications
+            ]
+            yield sha, changes, commit
+    else:
+        raise ValueError(f"unknown commit stats engine {engine}")
+
+
+def _chunk_modifications(repo_path, shas, engine, nloc):
+    """runs in a worker process, commits can't be sent back to the parent"""
+    git_repo = ReadOnlyGitRepository(repo_path)
+    try:
+        return [
+            (sha, changes, None)
+            for sha, changes, _ in _commit_modifications(git_repo, shas, engine, nloc)
+        ]
+    finally:
+        git_repo.clear()
 
 
-def update_commit_stats(git_commit, modifications):
+def update_commit_stats(git_commit, modifications, ignore=None):
     # TODO: evaluate how to update the stats carefully
+    ignore = ignore or ignore_matcher()
     added, removed, nloc = 0, 0, 0
     for mod in modifications:
         if mod.change_type is None:
             continue
         file_path = mod.old_path or mod.new_path
-        if should_ignore_path(file_path):
+        if ignore.match(file_path):
             continue
         added += mod.added
         removed += mod.removed
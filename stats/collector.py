@@ -1,6 +1,23 @@
 import traceback
+from datetime import datetime, timedelta
 
-from django.db import DatabaseError, IntegrityError, connection
+from django.db import DatabaseError, IntegrityError, connection, transaction
+
+from .models import EPOCH_ZERO, Author, AuthorStat
+
+# commits indexed in the last moments may still be in transactions that
+# are not committed yet, leave them to the next run
+SETTLE_TIME = timedelta(minutes=1)
+
+# a batch of commits is stamped with indexed_at when it is inserted, but
+# only visible once its transaction commits, which can take longer than
+# SETTLE_TIME, e.g. behind locks. each run recounts the authors with
+# commits indexed since RECOUNT_WINDOW before the last run, so a batch
+# is missed only when it commits more than this late
+RECOUNT_WINDOW = timedelta(hours=1)
+
+# any constant, serializes populate_author_stats across processes on postgres
+AUTHOR_STATS_LOCK_ID = 20230
 
 #  This SQL caculate the stats from commit table and populate the
 #  AuthorStat table
@@ -21,22 +38,156 @@ from (
             end statsid,
             sum(lines_added)                          lines_added,
             sum(lines_removed)                        lines_removed,
-            count(stats_commit)                       commit_count,
+            count(stats_commit.id)                    commit_count,
             sum(case when is_merge then 1 else 0 end) merge_commit_count
         from stats_commit
         join stats_author author on (author_id = author.id)
         left outer join  stats_author original on (author.original_id = original.id)
+        where stats_commit.indexed_at <= %s
         group by statsid
      ) c
 where c.statsid = stats_authorstat.id
 
 """
 
+#  This SQL recounts the AuthorStat of the authors with commits indexed
+#  since the given time, from all of their commits. commits counted by an
+#  earlier run are not added twice, so the window can overlap the last run
 
-def populate_author_stats():
+AUTHSTATS_SQL_RECOUNT = """
+
+with touched as (
+        select distinct
+            case
+                when author.is_alias then original.stats_id
+                else author.stats_id
+            end statsid
+        from stats_commit
+        join stats_author author on (author_id = author.id)
+        left outer join  stats_author original on (author.original_id = original.id)
+        where stats_commit.indexed_at > %s
+    ),
+    touched_authors as (
+        select author.id
+        from stats_author author
+        left outer join  stats_author original on (author.original_id = original.id)
+        where
+            case
+                when author.is_alias then original.stats_id
+                else author.stats_id
+            end in (select statsid from touched)
+    )
+update stats_authorstat
+set
+    lines_added = c.lines_added,
+    lines_removed = c.lines_removed,
+    commit_count = c.commit_count,
+    merge_commit_count = c.merge_commit_count
+from (
+        select
+            case
+                when author.is_alias then original.stats_id
+                else author.stats_id
+            end statsid,
+            sum(lines_added)                          lines_added,
+            sum(lines_removed)                        lines_removed,
+            count(stats_commit.id)                    commit_count,
+            sum(case when is_merge then 1 else 0 end) merge_commit_count
+        from stats_commit
+        join stats_author author on (author_id = author.id)
+        left outer join  stats_author original on (author.original_id = original.id)
+        where stats_commit.author_id in (select id from touched_authors)
+        group by statsid
+     ) c
+where c.statsid = stats_authorstat.id
+
+"""
+
+RESET_AUTHSTATS_SQL = """
+update stats_authorstat
+set lines_added = 0, lines_removed = 0, commit_count = 0, merge_commit_count = 0
+"""
+
+# authors created after the cutoff keep EPOCH_ZERO, all of their commits
+# are indexed after the cutoff and are added by the next run
+MARK_AUTHSTATS_SQL = """
+update stats_authorstat
+set last_status_at = %s
+where id in (select stats_id from stats_author where updated_at <= %s)
+"""
+
+
+def populate_author_stats(full=False, cutoff=None):
+    """
+    recount the stats of the authors with commits indexed since the last
+    run, see RECOUNT_WINDOW. the stats are rebuilt from all commits on
+    the first run, when full is True, or when an author was edited since
+    the last run, e.g. made an alias of another author, since that moves
+    commits between authors
+    """
+    cutoff = cutoff or datetime.now().astimezone() - SETTLE_TIME
     try:
-        cur = connection.cursor()
-        cur.execute(AUTHSTATS_SQL_1)
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                # runs from concurrent chords must not add the same delta twice
+                with connection.cursor() as cur:
+                    cur.execute(
+                        "select pg_advisory_xact_lock(%s)", [AUTHOR_STATS_LOCK_ID]
+                    )
+            since = last_author_stats_at()
+            if not full and since >= cutoff:
+                print("author stats already populated up to cutoff")
+                return
+            if not full and since == EPOCH_ZERO:
+                print("author stats never populated, rebuilding")
+                full = True
+            elif not full and authors_edited_since(since):
+                print("authors edited since last run, rebuilding author stats")
+                full = True
+
+            recount_since = connection.ops.adapt_datetimefield_value(
+                since - RECOUNT_WINDOW
+            )
+            cutoff = connection.ops.adapt_datetimefield_value(cutoff)
+            cur = connection.cursor()
+            if full:
+                cur.execute(RESET_AUTHSTATS_SQL)
+                cur.execute(AUTHSTATS_SQL_1, [cutoff])
+            else:
+                cur.execute(AUTHSTATS_SQL_RECOUNT, [recount_since])
+            cur.execute(MARK_AUTHSTATS_SQL, [cutoff, cutoff])
     except (DatabaseError, IntegrityError) as e:
         exc = traceback.format_exc()
         print(f"exception in populdate_author_stats => {e}\n{exc}")
+
+
+def last_author_stats_at():
+    """time up to which the indexed commits were counted by the last run"""
+    last = AuthorStat.objects.order_by("-last_status_at").first()
+    return last.last_status_at if last else EPOCH_ZERO
+
+
+def authors_edited_since(since):
+    # new authors have not been counted by any run yet
+    return (
+        Author.objects.filter(updated_at__gt=since)
+        .exclude(stats__last_status_at=EPOCH_ZERO)
+        .exists()
+    )
+
+
+def refresh_author_stats_view():
+    """
+    refresh the materialized stats_author_stats_view on postgres, the
+    admin keeps reading the old content while the refresh runs
+    """
+    if connection.vendor != "postgresql":
+        return
+    try:
+        with connection.cursor() as cur:
+            cur.execute(
+                "refresh materialized view concurrently stats_author_stats_view"
+            )
+    except DatabaseError as e:
+        exc = traceback.format_exc()
+        print(f"exception in refresh_author_stats_view => {e}\n{exc}")
@@ -0,0 +1,115 @@
+import json
+import os
+import sqlite3
+from functools import lru_cache
+
+from django.conf import settings
+from pydriller import ModificationType
+
+from .gitrepo import FileChange
+
+# sqlite limits the number of parameters of a query
+QUERY_CHUNK = 500
+
+
+class CommitCache:
+    """
+    modified files of each commit, persisted in a local sqlite file and
+    keyed by sha and the COMMIT_STATS_ENGINE that computed them, the
+    engines don't count the same changes, e.g. for merges. the diff of a
+    commit never changes, so it is computed once and reused by the
+    analyzer and the indexer, across runs and across forks of the same
+    repo. lines of code are optional, entries without them don't satisfy
+    lookups that need them
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # several indexer and analyzer processes share the file
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("pragma journal_mode=wal")
+        # entries of the first version of the cache don't record their engine
+        self.conn.execute("drop table if exists commit_changes")
+        self.conn.execute(
+            """
+            create table if not exists commit_engine_changes (
+                sha text not null,
+                engine text not null,
+                has_nloc integer not null,
+                changes text not null,
+                primary key (sha, engine)
+            )
+            """
+        )
+
+    def known(self, shas, engine: str, nloc: bool = False) -> set:
+        """return the shas that are in the cache for the engine"""
+        found = set()
+        for chunk in _chunks(list(shas)):
+            found.update(sha for (sha,) in self._select("sha", chunk, engine, nloc))
+        return found
+
+    def get_many(self, shas, engine: str, nloc: bool = False) -> dict:
+        """return {sha: [FileChange]} for the shas cached for the engine"""
+        found = {}
+        for chunk in _chunks(list(shas)):
+            for sha, changes in self._select("sha, changes", chunk, engine, nloc):
+                found[sha] = [_decode(change) for change in json.loads(changes)]
+        return found
+
+    def put_many(self, entries, engine: str, nloc: bool = False) -> None:
+        """store (sha, [FileChange]) entries computed by the engine"""
+        rows = [
+            (
+                sha,
+                engine,
+                int(nloc),
+                json.dumps([_encode(change) for change in changes]),
+            )
+            for sha, changes in entries
+        ]
+        if rows:
+            with self.conn:
+                self.conn.executemany(
+                    "insert or replace into commit_engine_changes values (?, ?, ?, ?)",
+                    rows,
+                )
+
+    def _select(self, columns, shas, engine, nloc):
+        params = ",".join("?" * len(shas))
+        sql = (
+            f"select {columns} from commit_engine_changes"
+            f" where engine = ? and sha in ({params})"
+        )
+        if nloc:
+            sql += " and has_nloc = 1"
+        return self.conn.execute(sql, [engine, *shas])
+
+
+def commit_cache():
+    """
+    the cache at COMMIT_CACHE_PATH, None when it is disabled by setting
+    COMMIT_CACHE_PATH to an empty string
+    """
+    if not settings.COMMIT_CACHE_PATH:
+        return None
+    # sqlite connections can't be shared with forked worker processes
+    return _open_cache(settings.COMMIT_CACHE_PATH, os.getpid())
+
+
+@lru_cache(maxsize=None)
+def _open_cache(path, pid):
+    return CommitCache(path)
+
+
+def _chunks(items):
+    for i in range(0, len(items), QUERY_CHUNK):
+        yield items[i : i + QUERY_CHUNK]
+
+
+def _encode(change):
+    return [change.change_type.name, *change[1:]]
+
+
+def _decode(values):
+    return FileChange(ModificationType[values[0]], *values[1:])
@@ -0,0 +1,394 @@
+import hashlib
+import os
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional
+
+from git import GitCommandError, Repo
+from lizard import analyze_file
+from lizard_languages import get_reader_for
+from pydriller import GitRepository, ModificationType
+
+from .mirror import mirror_path
+from .utils import is_remote_git_url
+
+# refs that are indexed, same as git rev-list --all minus stash and notes
+INDEXED_REFS = ["refs/heads", "refs/remotes", "refs/tags"]
+
+# status letters of git diff --raw
+CHANGE_TYPES = {
+    "A": ModificationType.ADD,
+    "C": ModificationType.COPY,
+    "D": ModificationType.DELETE,
+    "M": ModificationType.MODIFY,
+    "R": ModificationType.RENAME,
+    "T": ModificationType.MODIFY,
+}
+
+
+# path => (modification times of its git dir, probe result), see probe_repository
+_probe_cache = {}
+_probe_lock = threading.Lock()
+
+
+class FileChange(NamedTuple):
+    """a modified file, with the same attributes as pydriller Modification"""
+
+    change_type: ModificationType
+    old_path: Optional[str]
+    new_path: Optional[str]
+    added: int
+    removed: int
+    nloc: Optional[int] = None
+
+    @property
+    def filename(self) -> str:
+        return os.path.basename(self.new_path or self.old_path)
+
+    @staticmethod
+    def from_modification(mod, nloc: bool = True) -> "FileChange":
+        """pydriller counts lines of code when nloc is read, skip it unless needed"""
+        return FileChange(
+            change_type=mod.change_type,
+            old_path=mod.old_path,
+            new_path=mod.new_path,
+            added=mod.added,
+            removed=mod.removed,
+            nloc=mod.nloc if nloc else None,
+        )
+
+
+class ReadOnlyGitRepository(GitRepository):
+    """
+    GitRepository that does not write pydriller's blame setting into
+    .git/config when opened, so several processes can open the same repo.
+    it overrides internals of GitRepository, pydriller is pinned to the
+    version it was written for in pyproject.toml
+    """
+
+    def _open_repository(self):
+        self._repo = Repo(str(self.path))
+        if self._conf.get("main_branch") is None:
+            self._discover_main_branch(self._repo)
+
+
+@contextmanager
+def local_repository(repo_url: str):
+    """
+    yield a GitRepository for repo_url. remote repositories are read from
+    their local mirror, which must have been updated with update_mirror
+    """
+    path = mirror_path(repo_url) if is_remote_git_url(repo_url) else repo_url
+    git_repo = GitRepository(path)
+    try:
+        yield git_repo
+    finally:
+        # GitPython keeps file handles open
+        git_repo.clear()
+
+
+def probe_repository(path: str) -> bool:
+    """
+    check that path is a git repository, bare or not, whose HEAD resolves
+    to a commit, without walking its history. the result is cached until
+    HEAD or the refs of the repository change
+    """
+    git_dir, common_dir = _git_dirs(path)
+    signature = _git_dir_signature(git_dir, common_dir)
+    if signature is None:
+        return False
+    with _probe_lock:
+        cached = _probe_cache.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    # an explicit git dir stops git from looking for a repo in the parents
+    args = ["--git-dir", git_dir, "rev-parse", "--verify", "--quiet", "HEAD^{commit}"]
+    result = subprocess.run(
+        ["git", *args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    is_repo = result.returncode == 0
+    with _probe_lock:
+        _probe_cache[path] = (signature, is_repo)
+    return is_repo
+
+
+def clear_probe_cache() -> None:
+    """forget the results of probe_repository"""
+    with _probe_lock:
+        _probe_cache.clear()
+
+
+def _git_dirs(path):
+    """
+    the git dir of the repository at path and the common dir that holds
+    its refs. they differ for linked worktrees, and submodules and
+    worktrees have a .git file that points to their git dir
+    """
+    if os.path.isfile(os.path.join(path, "HEAD")):
+        git_dir = path
+    else:
+        git_dir = os.path.join(path, ".git")
+        if os.path.isfile(git_dir):
+            git_dir = os.path.join(path, _read_path(git_dir, "gitdir: "))
+    common_dir = git_dir
+    if os.path.isfile(os.path.join(git_dir, "commondir")):
+        common_dir = os.path.join(git_dir, _read_path(f"{git_dir}/commondir"))
+    return os.path.normpath(git_dir), os.path.normpath(common_dir)
+
+
+def _read_path(pointer, prefix=""):
+    with open(pointer) as f:
+        line = f.readline().strip()
+    return line[len(prefix) :] if line.startswith(prefix) else line
+
+
+def _git_dir_signature(git_dir, common_dir):
+    """modification times of the files a new commit or ref changes, if it's a git dir"""
+    paths = [
+        os.path.join(git_dir, "HEAD"),
+        os.path.join(common_dir, "refs"),
+        os.path.join(common_dir, "refs", "heads"),
+        os.path.join(common_dir, "packed-refs"),
+    ]
+    signature = []
+    for path in paths:
+        try:
+            signature.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            if path == paths[0]:
+                return None
+            signature.append(None)
+    return tuple(signature)
+
+
+def repository_size(repo_url: str) -> Optional[int]:
+    """
+    KiB of the objects the refs of the repository reach, or of the mirror
+    of a remote one, None when it isn't there yet. the objects a mirror
+    borrows from the shared store of its host count too, see stats/mirror.py
+    """
+    path = mirror_path(repo_url) if is_remote_git_url(repo_url) else repo_url
+    if not os.path.isdir(path):
+        return None
+    try:
+        output = _git("-C", path, "rev-list", "--all", "--objects", "--disk-usage")
+    except GitCommandError:
+        return None
+    return int(output) // 1024
+
+
+def ref_tips(git_repo: GitRepository) -> dict:
+    """return the commit each ref points to, as {ref name: sha}"""
+    output = git_repo.repo.git.for_each_ref(
+        *INDEXED_REFS, format="%(objectname) %(refname)"
+    )
+    return _ref_lines(output)
+
+
+def refs_fingerprint(repo_url: str, *extra: str) -> str:
+    """
+    hash of the tip of every indexed ref of the repository, without
+    opening it with pydriller. remote repositories are asked with
+    git ls-remote for the branches and tags their mirror fetches, so
+    it costs a round trip but no fetch. the extra strings are hashed
+    too, e.g. the settings the commits are indexed with
+    """
+    if is_remote_git_url(repo_url):
+        tips = remote_ref_tips(repo_url)
+    else:
+        tips = _ref_lines(
+            _git(
+                "-C",
+                repo_url,
+                "for-each-ref",
+                "--format=%(objectname) %(refname)",
+                *INDEXED_REFS,
+            )
+        )
+    lines = [f"{ref} {sha}" for ref, sha in sorted(tips.items())]
+    return hashlib.sha256("\n".join([*lines, *extra]).encode()).hexdigest()
+
+
+def remote_ref_tips(repo_url: str) -> dict:
+    """return the branches and tags of the remote repository, as {ref name: sha}"""
+    output = _git("ls-remote", "--heads", "--tags", repo_url)
+    # skip the commits annotated tags point to, the mirror has the tags
+    return {
+        ref: sha
+        for ref, sha in _ref_lines(output.replace("\t", " ")).items()
+        if not ref.endswith("^{}")
+    }
+
+
+def _git(*args):
+    result = subprocess.run(
+        ["git", *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    if result.returncode != 0:
+        raise GitCommandError(["git", *args], result.returncode, result.stderr)
+    return result.stdout
+
+
+def _ref_lines(output):
+    tips = {}
+    for line in output.splitlines():
+        sha, ref = line.split(" ", 1)
+        tips[ref] = sha
+    return tips
+
+
+def list_commits(git_repo: GitRepository, tips, bookmarks):
+    """
+    list, oldest first, the commits reachable from any of the tips but
+    not from any of the bookmarks, i.e. last_tip..new_tip of every ref.
+    yields (sha, committer date) parsed from a single git rev-list call,
+    without building any commit objects. bookmarks that no longer exist,
+    e.g. after a force push and gc, are ignored
+    """
+    tips = set(tips)
+    if not tips:
+        return
+    rev = sorted(tips) + sorted(f"^{sha}" for sha in set(bookmarks))
+    output = git_repo.repo.git.rev_list(
+        *rev, reverse=True, timestamp=True, ignore_missing=True
+    )
+    for line in output.splitlines():
+        timestamp, sha = line.split(" ", 1)
+        yield sha, datetime.fromtimestamp(int(timestamp), tz=timezone.utc)
+
+
+def head_commits(git_repo: GitRepository):
+    """
+    list, oldest first, the commits reachable from HEAD, the same commits
+    pydriller traverses by default. yields (sha, is merge)
+    """
+    output = git_repo.repo.git.rev_list("HEAD", reverse=True, parents=True)
+    for line in output.splitlines():
+        sha, *parents = line.split(" ")
+        yield sha, len(parents) > 1
+
+
+def numstat_changes(git_repo: GitRepository, shas, nloc: bool = False):
+    """
+    yield (sha, [FileChange]) for each of the commits, in the same order,
+    parsed incrementally from the output of a single git log --numstat
+    process. like pydriller, merge commits have no modified files.
+    lines of code are only counted when nloc is True, since that
+    requires reading the content of every modified file
+    """
+    if not shas:
+        return
+
+    # stderr goes to a file, a pipe nobody reads until stdout is done
+    # would block git once it fills up
+    stderr = tempfile.TemporaryFile()
+    proc = subprocess.Popen(
+        [
+            "git",
+            "log",
+            "--stdin",
+            "--no-walk=unsorted",
+            "--root",
+            "-M",
+            "--raw",
+            "--numstat",
+            "-z",
+            "--format=%x01%H",
+        ],
+        cwd=git_repo.path,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=stderr,
+    )
+    try:
+        # git reads all of stdin before writing any output
+        proc.stdin.write("\n".join(shas).encode())
+        proc.stdin.close()
+
+        sha, raw, numstat = None, [], []
+        tokens = _nul_separated(proc.stdout)
+        for token in tokens:
+            if token.startswith("\x01"):
+                if sha is not None:
+                    yield sha, _file_changes(git_repo, sha, raw, numstat, nloc)
+                sha, raw, numstat = token[1:], [], []
+            elif token.startswith(":"):
+                # :old_mode new_mode old_blob new_blob status, then the path(s)
+                _, _, old_blob, new_blob, status = token.split(" ")
+                paths = [next(tokens)]
+                if status[0] in "RC":
+                    paths.append(next(tokens))
+                elif status == "M" and old_blob == new_blob:
+                    # file mode change only, pydriller can't tell what it is
+                    status = "?"
+                raw.append((status[0], paths))
+            elif token:
+                added, removed, path = token.split("\t", 2)
+                if not path:
+                    # renamed or copied, old and new path follow
+                    next(tokens), next(tokens)
+                numstat.append((added, removed))
+        if sha is not None:
+            yield sha, _file_changes(git_repo, sha, raw, numstat, nloc)
+
+        if proc.wait() != 0:
+            stderr.seek(0)
+            raise GitCommandError("git log --numstat", proc.returncode, stderr.read())
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        stderr.close()
+
+
+def _nul_separated(stream):
+    buf = b""
+    while True:
+        chunk = stream.read(65536)
+        if not chunk:
+            break
+        *tokens, buf = (buf + chunk).split(b"\0")
+        for token in tokens:
+            yield token.lstrip(b"\n").decode("utf-8", "replace")
+    if buf.strip(b"\n"):
+        yield buf.strip(b"\n").decode("utf-8", "replace")
+
+
+def _file_changes(git_repo, sha, raw, numstat, nloc):
+    changes = []
+    # --raw and --numstat list the files in the same order
+    for (status, paths), (added, removed) in zip(raw, numstat):
+        change_type = CHANGE_TYPES.get(status, ModificationType.UNKNOWN)
+        old_path, new_path = paths[0], paths[-1]
+        if change_type == ModificationType.ADD:
+            old_path = None
+        elif change_type == ModificationType.DELETE:
+            new_path = None
+        changes.append(
+            FileChange(
+                change_type=change_type,
+                old_path=old_path,
+                new_path=new_path,
+                # binary files show up as "-"
+                added=int(added) if added != "-" else 0,
+                removed=int(removed) if removed != "-" else 0,
+                nloc=_nloc(git_repo, sha, new_path) if nloc else None,
+            )
+        )
+    return changes
+
+
+def _nloc(git_repo, sha, path):
+    """lines of code in the file as of the commit, counted by lizard like pydriller"""
+    if path is None or get_reader_for(os.path.basename(path)) is None:
+        return None
+    blob = git_repo.repo.commit(sha).tree / path
+    source = blob.data_stream.read().decode("utf-8", "ignore")
+    return analyze_file.analyze_source_code(os.path.basename(path), source).nloc
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# request headers that identify the caller, responses are cached per caller
+CREDENTIAL_HEADERS = ["Authorization", "PRIVATE-TOKEN", "JOB-TOKEN"]
+
+# the body is cached decoded, these headers don't apply to it anymore
+UNCACHED_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+
+class HttpCache:
+    """
+    GET responses that came with an ETag or a Last-Modified header,
+    persisted in a local sqlite file so that the next discovery run can
+    revalidate them with conditional requests
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute("pragma journal_mode=wal")
+        self.conn.execute(
+            """
+            create table if not exists http_responses (
+                key text primary key,
+                url text not null,
+                headers text not null,
+                body blob not null
+            )
+            """
+        )
+
+    def get(self, key):
+        """return (headers, body) of the cached response, or None"""
+        with self._lock:
+            row = self.conn.execute(
+                "select headers, body from http_responses where key = ?", [key]
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put(self, key, url, headers, body) -> None:
+        with self._lock, self.conn:
+            self.conn.execute(
+                "insert or replace into http_responses values (?, ?, ?, ?)",
+                [key, url, json.dumps(_cacheable(headers)), body],
+            )
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def http_cache():
+    """
+    the cache at HTTP_CACHE_PATH, None when it is disabled by setting
+    HTTP_CACHE_PATH to an empty string
+    """
+    if not settings.HTTP_CACHE_PATH:
+        return None
+    return HttpCache(settings.HTTP_CACHE_PATH)
+
+
+class CachingAdapter(HTTPAdapter):
+    """
+    revalidates cached GET responses with If-None-Match/If-Modified-Since
+    and serves the cached body when the server answers 304. also waits
+    out the rate limits announced by GitHub, GitLab and Bitbucket, up to
+    DISCOVER_RATE_LIMIT_WAIT seconds, instead of failing the listing
+    """
+
+    def __init__(self, cache: HttpCache = None, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+        self._lock = threading.Lock()
+        # host => time its rate limit resets, once the quota is used up
+        self._blocked_until = {}
+
+    def send(self, request, **kwargs):
+        host = urlparse(request.url).netloc
+        key = cached = None
+        if self.cache is not None and request.method == "GET":
+            key = _cache_key(request)
+            cached = self.cache.get(key)
+            if cached is not None:
+                _add_conditions(request, cached[0])
+
+        self._wait_for_quota(host)
+        response = super().send(request, **kwargs)
+        wait = _rate_limit_wait(response)
+        if wait is not None and wait <= settings.DISCOVER_RATE_LIMIT_WAIT:
+            print(f"rate limited by {host}, retrying in {wait:.0f}s")
+            response.close()
+            time.sleep(wait)
+            response = super().send(request, **kwargs)
+        self._track_quota(host, response)
+
+        if response.status_code == 304 and cached is not None:
+            return _cached_response(request, response, *cached)
+        if key is not None and response.status_code == 200:
+            if "ETag" in response.headers or "Last-Modified" in response.headers:
+                self.cache.put(key, request.url, response.headers, response.content)
+        return response
+
+    def _wait_for_quota(self, host):
+        with self._lock:
+            wait = self._blocked_until.pop(host, 0) - time.time()
+        if 0 < wait <= settings.DISCOVER_RATE_LIMIT_WAIT:
+            print(f"rate limit of {host} used up, waiting {wait:.0f}s")
+            time.sleep(wait)
+
+    def _track_quota(self, host, response):
+        headers = response.headers
+        remaining = _header(headers, "X-RateLimit-Remaining", "RateLimit-Remaining")
+        reset = _header(headers, "X-RateLimit-Reset", "RateLimit-Reset")
+        if remaining == "0" and reset and reset.isdigit():
+            with self._lock:
+                self._blocked_until[host] = int(reset)
+
+
+def _cache_key(request):
+    credentials = [request.headers.get(name, "") for name in CREDENTIAL_HEADERS]
+    data = "\n".join([request.url, *credentials]).encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+def _add_conditions(request, headers):
+    headers = CaseInsensitiveDict(headers)
+    if "ETag" in headers:
+        request.headers.setdefault("If-None-Match", headers["ETag"])
+    if "Last-Modified" in headers:
+        request.headers.setdefault("If-Modified-Since", headers["Last-Modified"])
+
+
+def _cached_response(request, not_modified, headers, body):
+    response = Response()
+    response.status_code = 200
+    response.reason = "OK"
+    response.headers = CaseInsensitiveDict(headers)
+    # the rate limit of the 304 is the current one
+    for name, value in not_modified.headers.items():
+        if "ratelimit" in name.lower():
+            response.headers[name] = value
+    response.headers["X-From-Cache"] = "1"
+    response._content = body
+    response.url = request.url
+    response.request = request
+    response.connection = not_modified.connection
+    response.encoding = get_encoding_from_headers(response.headers)
+    return response
+
+
+def _rate_limit_wait(response):
+    """seconds to wait before retrying a rate limited request, None if it isn't"""
+    headers = response.headers
+    if response.status_code == 429 or (
+        response.status_code == 403
+        and _header(headers, "X-RateLimit-Remaining", "RateLimit-Remaining") == "0"
+    ):
+        retry_after = headers.get("Retry-After")
+        if retry_after:
+            if retry_after.isdigit():
+                return int(retry_after)
+            try:
+                return max(
+                    0, parsedate_to_datetime(retry_after).timestamp() - time.time()
+                )
+            except (TypeError, ValueError):
+                pass
+        reset = _header(headers, "X-RateLimit-Reset", "RateLimit-Reset")
+        if reset and reset.isdigit():
+            return max(0, int(reset) - time.time())
+        return settings.DISCOVER_RATE_LIMIT_WAIT
+    return None
+
+
+def _cacheable(headers):
+    return {
+        name: value
+        for name, value in headers.items()
+        if name.lower() not in UNCACHED_HEADERS
+    }
+
+
+def _header(headers, *names):
+    for name in names:
+        if name in headers:
+            return headers[name]
+    return None
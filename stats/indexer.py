@@ -1,87 +1,313 @@
 import glob
+import hashlib
 import os
 import re
+import threading
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
-from datetime import datetime, timedelta
+from contextlib import contextmanager
+from datetime import datetime
 from fnmatch import fnmatch
 from os.path import expanduser
+from urllib.parse import urlparse
 
+import requests
 from atlassian import Bitbucket
-from git import GitCommandError, InvalidGitRepositoryError
-from github import BadCredentialsException, Github
+from django.conf import settings
+from django.db import transaction
 from gitlab import Gitlab, GitlabAuthenticationError, GitlabGetError
-from pydriller import GitRepository, RepositoryMining
 from requests import HTTPError
 
-from .analyzer import update_commit_stats
-from .models import Author, Commit, ConfigEntry, Repository
+from .analyzer import commit_modifications, update_commit_stats
+from .gitrepo import (
+    list_commits,
+    local_repository,
+    probe_repository,
+    ref_tips,
+    refs_fingerprint,
+)
+from .httpcache import CachingAdapter, http_cache
+from .mirror import update_mirror
+from .models import AuthorResolver, Commit, ConfigEntry, Repository
+from .partitions import ensure_commit_partitions
+from .rollups import rebuild_repository_rollups, update_commit_rollups
+from .utils import IGNORE_PATTERNS, ignore_matcher
 
 DEFAULT_CONFIG = "crawler.ini"
+GITHUB_API_URL = "https://api.github.com"
 
 
-def register_git_repositories(conf: ConfigParser = None) -> None:
-    for _, params in enumerate_repositories_by_config(conf):
-        Repository.register(**params)
+def register_git_repositories(conf: ConfigParser = None) -> int:
+    # discover everything first, then register in a single batch
+    found = [params for _, params in enumerate_repositories_by_config(conf)]
+    with transaction.atomic():
+        return Repository.register_all(found)
 
 
 def index_repository(repo_id) -> int:
     repo = Repository.objects.get(id=repo_id)
+    # a repo sent twice is only indexed by one run at a time
+    claimed = (
+        Repository.objects.filter(id=repo_id)
+        .exclude(status=Repository.RepoStatus.INUSE)
+        .update(status=Repository.RepoStatus.INUSE)
+    )
+    if not claimed:
+        print(f"Repository {repo.name} is being indexed already")
+        return 0
     repo.set_status(status=repo.RepoStatus.INUSE)
 
+    start = time.perf_counter()
     count = 0
     try:
+        stats_fingerprint = settings_fingerprint(repo)
+        fingerprint = refs_fingerprint(repo.repo_url, stats_fingerprint)
+        if is_indexed(repo, fingerprint):
+            # no ref moved since the last run, nothing to index
+            repo.schedule_next_index(0)
+            repo.set_status(status=repo.RepoStatus.READY)
+            print(f"Repository {repo.name} unchanged")
+            return 0
+
         old_commits = repo.all_commit_hash()
         last_commit_dt = repo.last_commit_at
+        authors = AuthorResolver()
+        ignore = repository_ignore_matcher(repo)
+        new_commits = []
 
-        for commit in RepositoryMining(
-            repo.repo_url, include_refs=True, include_remotes=True
-        ).traverse_commits():
-            commit_dt = commit.committer_date
-            if commit_dt > last_commit_dt:
-                last_commit_dt = commit_dt
-                # print(f"Updating last_commit_dt to {last_commit_dt}")
-
-            if commit.hash in old_commits:
-                continue
-
-            dev = commit.committer
-            author = Author.locate(name=dev.name, email=dev.email)
-            git_commit = Commit(
-                sha=commit.hash,
-                message=commit.msg[:2048],  # some commits has super long message
-                author=author,
-                repo=repo,
-                created_at=commit.committer_date,
-            )
-            update_commit_stats(git_commit, commit.modifications)
-            git_commit.save()
-            count += 1
+        if repo.is_remote:
+            repo.save_mirror_update(update_mirror(repo.repo_url))
+        with local_repository(repo.repo_url) as git_repo:
+            # only walk the commits added since the last run, for every ref
+            tips = ref_tips(git_repo)
+            if repo.stats_fingerprint not in (None, stats_fingerprint):
+                # the settings the commits are indexed with changed, the
+                # stored commits are computed again too
+                restat_commits(repo, git_repo, tips, ignore)
+            bookmarks = repo.ref_bookmarks()
+            if not all(sha in old_commits for sha in branch_tips(bookmarks)):
+                # commits were deleted from the database since the last
+                # run, walk the whole history again
+                bookmarks = {}
+            new_shas = []
+            for sha, commit_dt in list_commits(
+                git_repo, tips.values(), bookmarks.values()
+            ):
+                if commit_dt > last_commit_dt:
+                    last_commit_dt = commit_dt
+                if sha not in old_commits:
+                    new_shas.append(sha)
+
+            # only build commit objects and diffs for new commits
+            written_dt = repo.last_commit_at
+            for sha, modifications, commit in commit_modifications(git_repo, new_shas):
+                commit = commit or git_repo.get_commit(sha)
+                dev = commit.committer
+                author = authors.locate(name=dev.name, email=dev.email)
+                git_commit = Commit(
+                    sha=commit.hash,
+                    message=commit.msg[:2048],  # some commits has super long message
+                    author=author,
+                    repo=repo,
+                    created_at=commit.committer_date,
+                )
+                update_commit_stats(git_commit, modifications, ignore)
+                new_commits.append(git_commit)
+                written_dt = max(written_dt, commit.committer_date)
+
+                if len(new_commits) >= settings.INDEX_BATCH_SIZE:
+                    count += save_commits(repo, new_commits, authors, written_dt)
+                    new_commits = []
+
+        count += save_commits(repo, new_commits, authors, written_dt)
+        with transaction.atomic():
+            repo.save_ref_bookmarks(tips)
+        repo.index_seconds = time.perf_counter() - start
+        repo.last_commit_at = last_commit_dt
+        repo.schedule_next_index(count)
+        repo.refs_fingerprint = fingerprint
+        repo.stats_fingerprint = stats_fingerprint
         repo.set_status(status=repo.RepoStatus.READY, last_commit_dt=last_commit_dt)
         print(f"Indexed repository {repo.name}")
     # TODO: need to narrow this down
     except Exception as e:
         exc = traceback.format_exc()
         print(f"Exception indexing repository {repo.name} => {str(e)}\n{exc}")
+        # back off like a run without commits, a repo that keeps failing
+        # isn't sent again on every run
+        repo.schedule_next_index(0)
         repo.set_status(status=repo.RepoStatus.ERROR, errmsg=exc)
 
     return count
 
 
-def repositories_for_indexing(status=Repository.RepoStatus.READY, cut_off=None) -> int:
-    # by default set cut_off time to 15 mins before
-    cut_off = cut_off or datetime.now().astimezone() - timedelta(minutes=15)
-    count = 0
-    for repo in Repository.objects.filter(
-        status=status, last_status_at__lt=cut_off, enabled=True
-    ):
-        count += 1
-        yield repo
-    print(f"scanned {count} repositories")
-    return count
+def is_indexed(repo, fingerprint) -> bool:
+    """
+    true if the refs and settings of the repo didn't change since its last
+    run, and the commits its branches pointed to are still in the database
+    """
+    if fingerprint != repo.refs_fingerprint:
+        return False
+    heads = branch_tips(repo.ref_bookmarks())
+    # commits deleted since, e.g. by hand, are indexed again
+    return Commit.objects.filter(repo=repo, sha__in=heads).count() == len(heads)
+
+
+def branch_tips(bookmarks) -> set:
+    """the commits the branches pointed to, tags may point to tag objects"""
+    return {sha for ref, sha in bookmarks.items() if ref.startswith("refs/heads/")}
+
+
+def index_settings(repo) -> list:
+    """the settings that change the stats of the commits of the repo"""
+    section = repository_section(repo)
+    patterns = section.get("ignore_patterns") if section is not None else None
+    return [
+        settings.COMMIT_STATS_ENGINE,
+        str(settings.COMMIT_STATS_NLOC),
+        patterns or "\n".join(IGNORE_PATTERNS),
+    ]
+
+
+def settings_fingerprint(repo) -> str:
+    """hash of the index_settings of the repo"""
+    return hashlib.sha256("\n".join(index_settings(repo)).encode()).hexdigest()
+
+
+def repository_section(repo):
+    """the section of crawler.ini the repo was discovered from, if it still exists"""
+    conf = ConfigEntry.get(DEFAULT_CONFIG)
+    if conf is None or not conf.has_section(repo.section or ""):
+        return None
+    return conf[repo.section]
+
+
+def repository_ignore_matcher(repo):
+    """return the matcher of paths to ignore configured for the repo's project"""
+    return ignore_matcher(repository_section(repo))
+
+
+def save_commits(repo, commits, authors, last_commit_dt) -> int:
+    """
+    write a batch of new commits in its own transaction, together with
+    their new authors, their rollups and the last_commit_at high-water
+    mark of the repository. when indexing crashes midway the batches
+    already written are kept, and the next run skips them because their
+    hashes are already in the database. commits already stored for the
+    repository are skipped, on postgres the unique constraint of the
+    partitioned table also includes created_at and can't enforce it
+    """
+    stored = set(
+        Commit.objects.filter(
+            repo=repo, sha__in=[commit.sha for commit in commits]
+        ).values_list("sha", flat=True)
+    )
+    commits = [commit for commit in commits if commit.sha not in stored]
+    if not commits:
+        return 0
+    with transaction.atomic():
+        authors.flush()
+        ensure_commit_partitions(commit.created_at for commit in commits)
+        Commit.objects.bulk_create(commits)
+        update_commit_rollups(commits)
+        Repository.objects.filter(id=repo.id).update(last_commit_at=last_commit_dt)
+    return len(commits)
+
+
+def restat_commits(repo, git_repo, tips, ignore) -> int:
+    """
+    compute the stats of the commits stored for the repository again, e.g.
+    after the settings they are indexed with changed, and rebuild its
+    rollups. the commits get a new indexed_at, so the author stats count
+    them again. commits no longer reachable from any ref keep their stats
+    """
+    stored = repo.all_commit_hash()
+    shas = [
+        sha for sha, _ in list_commits(git_repo, tips.values(), []) if sha in stored
+    ]
+    batch = {}
+    for sha, modifications, _ in commit_modifications(git_repo, shas):
+        batch[sha] = modifications
+        if len(batch) >= settings.INDEX_BATCH_SIZE:
+            save_commit_stats(repo, batch, ignore)
+            batch = {}
+    save_commit_stats(repo, batch, ignore)
+    rebuild_repository_rollups(repo.id)
+    return len(shas)
+
+
+def save_commit_stats(repo, modifications, ignore) -> None:
+    """write the stats computed again for a batch of stored commits"""
+    commits = list(Commit.objects.filter(repo=repo, sha__in=list(modifications)))
+    indexed_at = datetime.now().astimezone()
+    for commit in commits:
+        update_commit_stats(commit, modifications[commit.sha], ignore)
+        commit.indexed_at = indexed_at
+    with transaction.atomic():
+        Commit.objects.bulk_update(
+            commits,
+            ["lines_added", "lines_removed", "lines_of_code", "is_merge", "indexed_at"],
+        )
+
 
+class DiscoveryClients:
+    """
+    HTTP sessions and per host concurrency limits shared by the sections
+    of crawler.ini being discovered at the same time. the sessions send
+    conditional requests for the responses in the http cache and wait
+    out rate limits, see CachingAdapter
+    """
 
-def enumerate_gitlab_projects(section):
+    def __init__(self, per_host: int = None):
+        self.per_host = per_host or settings.DISCOVER_HOST_CONCURRENCY
+        self.cache = http_cache()
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._limits = {}
+
+    def session(self, *key) -> requests.Session:
+        """a session for the server and credentials in key, reused across sections"""
+        with self._lock:
+            if key not in self._sessions:
+                session = requests.Session()
+                self._mount(session)
+                self._sessions[key] = session
+            return self._sessions[key]
+
+    def _mount(self, session):
+        adapter = CachingAdapter(self.cache, pool_maxsize=self.per_host)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+    @contextmanager
+    def limit(self, url):
+        """hold one of the per_host slots of the url's host"""
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._limits:
+                self._limits[host] = threading.BoundedSemaphore(self.per_host)
+            semaphore = self._limits[host]
+        with semaphore:
+            yield
+
+    def close(self):
+        for session in self._sessions.values():
+            session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+def _probe_repository(path):
+    try:
+        return probe_repository(path)
+    except Exception as e:
+        print(f"exception when opening git repository at {path} => {e}")
+        return False
+
+
+def enumerate_gitlab_projects(section, clients: DiscoveryClients = None):
     xfilter = section.get("filter", "*")
     group = section.get("group")
     url = section.get("gitlab_url", "https://gitlab.com")
@@ -89,12 +315,18 @@ def enumerate_gitlab_projects(section):
     token = section.get("gitlab_token")
     if token is None:
         token = os.environ.get("GITLAB_TOKEN")
+    clients = clients or DiscoveryClients()
     try:
-        gl = Gitlab(url, private_token=token, ssl_verify=ssl_verify)
-        projects = gl.groups.get(group).projects.list(
-            include_subgroups=True, as_list=False
-        )
-        return [proj for proj in projects if fnmatch(proj.path_with_namespace, xfilter)]
+        # python-gitlab sends the token with each request, not in the session
+        session = clients.session(url)
+        gl = Gitlab(url, private_token=token, ssl_verify=ssl_verify, session=session)
+        with clients.limit(url):
+            projects = gl.groups.get(group).projects.list(
+                include_subgroups=True, as_list=False
+            )
+            return [
+                proj for proj in projects if fnmatch(proj.path_with_namespace, xfilter)
+            ]
     except GitlabAuthenticationError:
         print(f"authentication error {url}, {token}, {ssl_verify}")
     except GitlabGetError as e:
@@ -102,32 +334,52 @@ def enumerate_gitlab_projects(section):
     return []
 
 
-def enumerate_github_projects(section):
+def enumerate_github_projects(section, clients: DiscoveryClients = None):
     xfilter = section.get("filter", "*")
     query = section.get("query")
+    url = section.get("github_url", GITHUB_API_URL)
     token = section.get("access_token")
+    clients = clients or DiscoveryClients()
+    # the token is sent with each request, not stored in the session
+    headers = {"Accept": "application/vnd.github+json"}
+    if token:
+        headers["Authorization"] = f"token {token}"
     try:
-        gh = Github(token)
-        result = gh.search_repositories(query=query)
-        return [proj for proj in result if fnmatch(proj.full_name, xfilter)]
-    except BadCredentialsException as e:
-        print(f"authentication error => {e}")
-    except Exception as e:
-        print(f"gitlab search {query} error {type(e)} => {e}")
+        result = []
+        session = clients.session(url)
+        with clients.limit(url):
+            page = f"{url}/search/repositories"
+            params = {"q": query, "per_page": 100}
+            while page:
+                response = session.get(page, params=params, headers=headers)
+                response.raise_for_status()
+                result += response.json()["items"]
+                # the url of the next page carries the query
+                page, params = response.links.get("next", {}).get("url"), None
+        return [proj for proj in result if fnmatch(proj["full_name"], xfilter)]
+    except HTTPError as e:
+        if e.response.status_code == 401:
+            print(f"authentication error => {e}")
+        else:
+            print(f"github search {query} error {type(e)} => {e}")
     return []
 
 
-def enumerate_bitbucket_projects(section):
+def enumerate_bitbucket_projects(section, clients: DiscoveryClients = None):
     xfilter = section.get("filter", "*")
     query = section.get("query")
     url = section.get("bitbucket_url")
     username = section.get("username")
     token = section.get("access_token")
+    clients = clients or DiscoveryClients()
     try:
         result = []
-        bb = Bitbucket(url=url, username=username, password=token)
-        result = bb.repo_list(project_key=query)
-        return [repo for repo in result if fnmatch(repo["slug"], xfilter)]
+        # the atlassian client stores the credentials in the session
+        session = clients.session(url, username, token)
+        bb = Bitbucket(url=url, username=username, password=token, session=session)
+        with clients.limit(url):
+            result = bb.repo_list(project_key=query)
+            return [repo for repo in result if fnmatch(repo["slug"], xfilter)]
     except HTTPError as e:
         print(f"HTTPError => {e}")
     except Exception as e:
@@ -135,68 +387,90 @@ def enumerate_bitbucket_projects(section):
     return []
 
 
-def enumerate_repositories_by_config(conf):
+def enumerate_repositories_by_config(conf, workers: int = None):
+    """
+    yield (is remote, registration params) of the repositories found by
+    every project section of crawler.ini. the sections are discovered
+    concurrently, the results keep the order of the sections
+    """
     conf = conf or ConfigEntry.get(DEFAULT_CONFIG)
     assert conf is not None
 
-    for key in [s for s in conf.sections() if s.find("project.") == 0]:
-        section = conf[key]
-        params = {"repo_type": section.get("type", "UNKNOWN")}
-
-        local_path = section.get("local_path")
-        is_local_repo = local_path is not None
-        if local_path and local_path[0] == "~":
-            local_path = expanduser(local_path)
-
-        if is_local_repo:
-            # local repo, just scan the local paths
-            xfilter = section.get("filter", "*")
-
-            for path in glob.glob(f"{local_path}/{xfilter}", recursive=True):
-                try:
-                    if GitRepository(path).total_commits() > 0:
-                        repo_name = path.replace(local_path, "")
-                        params["name"] = repo_name
-                        params["repo_url"] = path
-                        params["gitweb_base_url"] = section.get("gitweb_base_url")
-                        yield False, params
-                except (InvalidGitRepositoryError, GitCommandError):
-                    # print(f"skipping non Git path {path}")
-                    pass
-                except Exception as e:
-                    print(f"exception when opening git repository at {path} => {e}")
+    keys = [s for s in conf.sections() if s.find("project.") == 0]
+    clients = DiscoveryClients()
+    try:
+        with ThreadPoolExecutor(workers or settings.DISCOVER_WORKERS) as pool:
+            for repos in pool.map(
+                lambda key: _discover_section(key, conf[key], clients), keys
+            ):
+                yield from repos
+    finally:
+        clients.close()
+
+
+def _discover_section(key, section, clients) -> list:
+    """a section that fails doesn't stop the others from being registered"""
+    try:
+        return list(enumerate_section(key, section, clients))
+    except Exception as e:
+        exc = traceback.format_exc()
+        print(f"exception discovering repositories of {key} => {e}\n{exc}")
+        return []
+
+
+def enumerate_section(key, section, clients):
+    params = {"repo_type": section.get("type", "UNKNOWN"), "section": key}
+
+    local_path = section.get("local_path")
+    is_local_repo = local_path is not None
+    if local_path and local_path[0] == "~":
+        local_path = expanduser(local_path)
+
+    if is_local_repo:
+        # local repo, just scan the local paths
+        xfilter = section.get("filter", "*")
+
+        paths = glob.glob(f"{local_path}/{xfilter}", recursive=True)
+        with ThreadPoolExecutor(settings.DISCOVER_WORKERS) as pool:
+            for path, is_repo in zip(paths, pool.map(_probe_repository, paths)):
+                if is_repo:
+                    repo_name = path.replace(local_path, "")
+                    params["name"] = repo_name
+                    params["repo_url"] = path
+                    params["gitweb_base_url"] = section.get("gitweb_base_url")
+                    yield False, dict(params)
+    else:
+        # remote project, get project info from gitlab
+        server_type = section.get("gitserver_type", "github")
+        if server_type == "gitlab":
+            for proj in enumerate_gitlab_projects(section, clients):
+                params["name"] = proj.path_with_namespace
+                params["repo_url"] = proj.ssh_url_to_repo
+                params["gitweb_base_url"] = proj.web_url
+                yield True, dict(params)
+        elif server_type == "bitbucket":
+            for proj in enumerate_bitbucket_projects(section, clients):
+                # bitbucket api returns url in format of
+                # ssh://git@innersource.blah.com/~user/some-stuff.git
+                # transform to git@github.com:user/repo.git
+                # otherwise pydrill can't process it
+                link = [d for d in proj["links"]["clone"] if d["name"] == "ssh"][0]
+                params["name"] = f"{proj['project']['key']}/{proj['slug']}"
+                params["repo_url"] = re.sub(r"^ssh://(.*?)/", r"\1:", link["href"])
+                params["gitweb_base_url"] = proj["links"]["self"][0]["href"]
+                yield True, dict(params)
+        elif server_type == "github":
+            for proj in enumerate_github_projects(section, clients):
+                # github api returns git://github.com/sloppycoder/bank-demo.git
+                # transform to git@github.com:user/repo.git
+                # otherwise pydrill can't process it
+                url = re.sub(r"^(git://)(.*?)/", r"git@\2:", proj["git_url"])
+                params["name"] = proj["full_name"]
+                params["repo_url"] = url
+                params["gitweb_base_url"] = proj["html_url"]
+                yield True, dict(params)
         else:
-            # remote project, get project info from gitlab
-            server_type = section.get("gitserver_type", "github")
-            if server_type == "gitlab":
-                for proj in enumerate_gitlab_projects(section):
-                    params["name"] = proj.path_with_namespace
-                    params["repo_url"] = proj.ssh_url_to_repo
-                    params["gitweb_base_url"] = proj.web_url
-                    yield True, params
-            elif server_type == "bitbucket":
-                for proj in enumerate_bitbucket_projects(section):
-                    # bitbucket api returns url in format of
-                    # ssh://git@innersource.blah.com/~user/some-stuff.git
-                    # transform to git@github.com:user/repo.git
-                    # otherwise pydrill can't process it
-                    link = [d for d in proj["links"]["clone"] if d["name"] == "ssh"][0]
-                    params["name"] = f"{proj['project']['key']}/{proj['slug']}"
-                    params["repo_url"] = re.sub(r"^ssh://(.*?)/", r"\1:", link["href"])
-                    params["gitweb_base_url"] = proj["links"]["self"][0]["href"]
-                    yield True, params
-            elif server_type == "github":
-                for proj in enumerate_github_projects(section):
-                    # github api returns git://github.com/sloppycoder/bank-demo.git
-                    # transform to git@github.com:user/repo.git
-                    # otherwise pydrill can't process it
-                    url = re.sub(r"^(git://)(.*?)/", r"git@\2:", proj.git_url)
-                    params["name"] = proj.full_name
-                    params["repo_url"] = url
-                    params["gitweb_base_url"] = proj.html_url
-                    yield True, params
-            else:
-                print(f"Unknow server_type = {server_type}, why?!")
+            print(f"Unknow server_type = {server_type}, why?!")
 
 
 def active_repos():
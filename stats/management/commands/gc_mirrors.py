@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from stats.mirror import gc_mirrors
+
+
+class Command(BaseCommand):
+    help = "Prune the objects no mirror reaches from the shared object stores"  # noqa: A003,VNE003,E501
+
+    def handle(self, *args, **options):
+        for host in gc_mirrors():
+            print(f"{host} shared object store collected")
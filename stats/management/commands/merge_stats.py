@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from stats.analyzer import merge_stats
+
+
+class Command(BaseCommand):
+    help = "Build the json and csv reports from partial .ndjson stats files"  # noqa: A003,VNE003,E501
+
+    def add_arguments(self, parser):
+        parser.add_argument("report_file", help="report name, without extension")
+        parser.add_argument("partial_files", nargs="+")
+
+    def handle(self, *args, **options):
+        merge_stats(options["partial_files"], options["report_file"])
+        print(f"{options['report_file']}.json and .csv written")
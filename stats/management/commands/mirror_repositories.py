@@ -0,0 +1,31 @@
+from fnmatch import fnmatch
+
+from django.core.management.base import BaseCommand
+from git import GitCommandError
+
+from stats.mirror import update_mirror
+from stats.models import Repository
+
+
+class Command(BaseCommand):
+    help = "Clone or fetch the local mirrors of the enabled remote repositories"  # noqa: A003,VNE003,E501
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "patterns", nargs="*", help="only repositories whose name matches"
+        )
+
+    def handle(self, *args, **options):
+        patterns = options["patterns"] or ["*"]
+        repos = Repository.objects.filter(enabled=True, is_remote=True).order_by("name")
+        for repo in repos:
+            if not any(fnmatch(repo.name, pattern) for pattern in patterns):
+                continue
+            try:
+                update = update_mirror(repo.repo_url)
+            except GitCommandError as e:
+                print(f"Exception mirroring repository {repo.name} => {str(e)}")
+                continue
+            repo.save_mirror_update(update)
+            action = "cloned" if update.cloned else "fetched"
+            print(f"{repo.name} {action} in {update.seconds:.1f}s => {update.path}")
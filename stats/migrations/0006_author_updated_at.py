@@ -0,0 +1,38 @@
+# Generated by Django 4.0.7 on 2026-10-18 12:30
+
+from django.db import migrations, models
+
+# SQLite rebuilds the table when adding a column, which fails while
+# stats_author_stats_view references it, drop and recreate the view around it
+VIEW_SQL = """
+create view stats_author_stats_view
+as
+    select stats_author.id id, name, email, tag1, tag2, tag3,
+           lines_added, lines_removed, commit_count, merge_commit_count
+    from stats_author
+    join stats_authorstat  on stats_id = stats_authorstat.id
+    where is_alias is False and (tag1 is NULL or tag1 <> 'EXT')
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0005_auto_20210113_1037"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[("drop view stats_author_stats_view;", [])],
+            reverse_sql=[(VIEW_SQL, [])],
+        ),
+        migrations.AddField(
+            model_name="author",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunSQL(
+            sql=[(VIEW_SQL, [])],
+            reverse_sql=[("drop view stats_author_stats_view;", [])],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.0.7 on 2026-10-18 12:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0006_author_updated_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RefBookmark",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("ref", models.CharField(max_length=512)),
+                ("sha", models.CharField(max_length=40)),
+                (
+                    "repo",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="stats.repository",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("repo", "ref")},
+            },
+        ),
+    ]
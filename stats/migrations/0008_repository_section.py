@@ -0,0 +1,18 @@
+# Generated by Django 4.0.7 on 2026-10-18 12:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0007_refbookmark"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="repository",
+            name="section",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
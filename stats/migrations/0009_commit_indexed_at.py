@@ -0,0 +1,22 @@
+# Generated by Django 4.0.7 on 2026-10-18 13:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0008_repository_section"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="commit",
+            name="indexed_at",
+            field=models.DateTimeField(
+                auto_now_add=True, db_index=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+    ]
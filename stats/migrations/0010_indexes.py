@@ -0,0 +1,74 @@
+# Generated by Django 4.0.7 on 2026-10-18 13:20
+
+from django.db import migrations, models
+
+# SQLite rebuilds the table when altering a column, which fails while
+# stats_author_stats_view references it, drop and recreate the view around it
+VIEW_SQL = """
+create view stats_author_stats_view
+as
+    select stats_author.id id, name, email, tag1, tag2, tag3,
+           lines_added, lines_removed, commit_count, merge_commit_count
+    from stats_author
+    join stats_authorstat  on stats_id = stats_authorstat.id
+    where is_alias is False and (tag1 is NULL or tag1 <> 'EXT')
+"""
+
+# keep the first copy of commits indexed more than once before the
+# unique constraint is added
+DEDUP_COMMITS_SQL = """
+delete from stats_commit
+where id not in (
+    select min(id) from stats_commit group by repo_id, sha
+)
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0009_commit_indexed_at"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[("drop view stats_author_stats_view;", [])],
+            reverse_sql=[(VIEW_SQL, [])],
+        ),
+        migrations.AlterField(
+            model_name="author",
+            name="email",
+            field=models.CharField(db_index=True, max_length=64),
+        ),
+        migrations.RunSQL(
+            sql=[(VIEW_SQL, [])],
+            reverse_sql=[("drop view stats_author_stats_view;", [])],
+        ),
+        migrations.AlterField(
+            model_name="commit",
+            name="created_at",
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name="repository",
+            name="name",
+            field=models.CharField(db_index=True, max_length=512),
+        ),
+        migrations.AddIndex(
+            model_name="repository",
+            index=models.Index(
+                fields=["status", "enabled", "last_status_at"],
+                name="stats_repo_for_indexing_idx",
+            ),
+        ),
+        migrations.RunSQL(
+            sql=[(DEDUP_COMMITS_SQL, [])],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddConstraint(
+            model_name="commit",
+            constraint=models.UniqueConstraint(
+                fields=("repo", "sha"), name="stats_commit_repo_sha_uniq"
+            ),
+        ),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations
+
+VIEW_SELECT = """
+    select stats_author.id id, name, email, tag1, tag2, tag3,
+           lines_added, lines_removed, commit_count, merge_commit_count
+    from stats_author
+    join stats_authorstat  on stats_id = stats_authorstat.id
+    where is_alias is False and (tag1 is NULL or tag1 <> 'EXT')
+"""
+
+# the unique index on id is required by refresh materialized view concurrently
+MATERIALIZED_VIEW_SQL = [
+    "drop view stats_author_stats_view",
+    f"create materialized view stats_author_stats_view as {VIEW_SELECT}",
+    "create unique index stats_author_stats_view_id on stats_author_stats_view (id)",
+    "create index stats_author_stats_view_commit_count"
+    " on stats_author_stats_view (commit_count)",
+    "create index stats_author_stats_view_tag1 on stats_author_stats_view (tag1)",
+    "create index stats_author_stats_view_tag2 on stats_author_stats_view (tag2)",
+    "create index stats_author_stats_view_tag3 on stats_author_stats_view (tag3)",
+]
+
+PLAIN_VIEW_SQL = [
+    "drop materialized view stats_author_stats_view",
+    f"create view stats_author_stats_view as {VIEW_SELECT}",
+]
+
+
+def run_on_postgres(statements):
+    # SQLite has no materialized views, the tests keep using the plain view
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == "postgresql":
+            for sql in statements:
+                schema_editor.execute(sql)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0010_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_on_postgres(MATERIALIZED_VIEW_SQL),
+            run_on_postgres(PLAIN_VIEW_SQL),
+        ),
+    ]
@@ -0,0 +1,107 @@
+# Generated by Django 4.0.7 on 2026-10-18 13:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Case, Count, F, Q, Sum, When
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+
+
+def rollup_existing_commits(apps, schema_editor):
+    """
+    same as stats.rollups.rebuild_commit_rollups, kept here so the migration
+    only uses the models as of this migration
+    """
+    Commit = apps.get_model("stats", "Commit")
+    CommitRollup = apps.get_model("stats", "CommitRollup")
+    periods = {"day": TruncDay, "week": TruncWeek, "month": TruncMonth}
+    for period, trunc in periods.items():
+        rows = (
+            Commit.objects.annotate(
+                bucket=trunc("created_at", output_field=models.DateField()),
+                rollup_author=Case(
+                    When(
+                        author__is_alias=True,
+                        author__original__isnull=False,
+                        then=F("author__original_id"),
+                    ),
+                    default=F("author_id"),
+                ),
+            )
+            .values("bucket", "rollup_author", "repo_id")
+            .annotate(
+                total_added=Sum("lines_added"),
+                total_removed=Sum("lines_removed"),
+                total_commits=Count("id"),
+                total_merges=Count("id", filter=Q(is_merge=True)),
+            )
+            .order_by()
+        )
+        CommitRollup.objects.bulk_create(
+            (
+                CommitRollup(
+                    period=period,
+                    bucket=row["bucket"],
+                    author_id=row["rollup_author"],
+                    repo_id=row["repo_id"],
+                    lines_added=row["total_added"],
+                    lines_removed=row["total_removed"],
+                    commit_count=row["total_commits"],
+                    merge_commit_count=row["total_merges"],
+                )
+                for row in rows.iterator()
+            ),
+            batch_size=5000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0011_materialize_author_stats_view"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CommitRollup",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "period",
+                    models.CharField(
+                        choices=[("day", "Day"), ("week", "Week"), ("month", "Month")],
+                        max_length=8,
+                    ),
+                ),
+                ("bucket", models.DateField()),
+                ("lines_added", models.IntegerField(default=0)),
+                ("lines_removed", models.IntegerField(default=0)),
+                ("commit_count", models.IntegerField(default=0)),
+                ("merge_commit_count", models.IntegerField(default=0)),
+                (
+                    "author",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT, to="stats.author"
+                    ),
+                ),
+                (
+                    "repo",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        to="stats.repository",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("period", "bucket", "author", "repo")},
+            },
+        ),
+        migrations.RunPython(rollup_existing_commits, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,97 @@
+from datetime import datetime, timezone
+
+from django.db import migrations
+
+# postgres requires the partition key in the primary key and in unique
+# constraints, a commit's created_at never changes so (repo, sha) stays unique
+
+
+def table_definition(cur):
+    """the indexes and foreign keys of stats_commit, to recreate them"""
+    cur.execute(
+        """
+        select indexdef from pg_indexes
+        where tablename = 'stats_commit'
+          and indexname not in ('stats_commit_pkey', 'stats_commit_repo_sha_uniq')
+        """
+    )
+    indexes = [indexdef for (indexdef,) in cur.fetchall()]
+    cur.execute(
+        """
+        select conname, pg_get_constraintdef(oid) from pg_constraint
+        where conrelid = 'stats_commit'::regclass and contype = 'f'
+        """
+    )
+    return indexes, cur.fetchall()
+
+
+def rebuild_commit_table(cur, partitioned):
+    indexes, foreign_keys = table_definition(cur)
+    cur.execute("alter sequence stats_commit_id_seq owned by none")
+    cur.execute("alter table stats_commit rename to stats_commit_old")
+    if partitioned:
+        from stats.partitions import create_partition, month_of, next_month
+
+        cur.execute(
+            "create table stats_commit (like stats_commit_old including defaults)"
+            " partition by range (created_at)"
+        )
+        cur.execute(
+            "create table stats_commit_default partition of stats_commit default"
+        )
+        cur.execute(
+            "select distinct date_trunc('month', created_at at time zone 'UTC')"
+            " from stats_commit_old"
+        )
+        months = {month.replace(tzinfo=timezone.utc) for (month,) in cur.fetchall()}
+        # partitions ahead of time for the commits of the next weeks
+        months.add(month_of(datetime.now(timezone.utc)))
+        months.add(next_month(month_of(datetime.now(timezone.utc))))
+        for month in sorted(months):
+            create_partition(cur, month)
+        primary_key, unique = "id, created_at", "repo_id, sha, created_at"
+    else:
+        cur.execute(
+            "create table stats_commit (like stats_commit_old including defaults)"
+        )
+        primary_key, unique = "id", "repo_id, sha"
+
+    # indexes are created after the data is copied, much faster that way
+    cur.execute("insert into stats_commit select * from stats_commit_old")
+    cur.execute("drop table stats_commit_old")
+    cur.execute("alter sequence stats_commit_id_seq owned by stats_commit.id")
+    cur.execute(
+        f"alter table stats_commit add constraint stats_commit_pkey"
+        f" primary key ({primary_key})"
+    )
+    cur.execute(
+        f"alter table stats_commit add constraint stats_commit_repo_sha_uniq"
+        f" unique ({unique})"
+    )
+    for indexdef in indexes:
+        cur.execute(indexdef)
+    for name, definition in foreign_keys:
+        cur.execute(f"alter table stats_commit add constraint {name} {definition}")
+
+
+def partition_commit_table(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        with schema_editor.connection.cursor() as cur:
+            rebuild_commit_table(cur, partitioned=True)
+
+
+def unpartition_commit_table(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        with schema_editor.connection.cursor() as cur:
+            rebuild_commit_table(cur, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0012_commitrollup"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_commit_table, unpartition_commit_table),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.7 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0013_partition_commit"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="repository",
+            name="clone_seconds",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="repository",
+            name="fetch_seconds",
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
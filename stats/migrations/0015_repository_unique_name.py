@@ -0,0 +1,39 @@
+# Generated by Django 4.0.7 on 2026-10-18 13:10
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def rename_duplicates(apps, schema_editor):
+    """
+    names were not unique before, keep the oldest repository under its
+    name, the others keep their commits but are renamed and disabled
+    """
+    Repository = apps.get_model("stats", "Repository")
+    names = (
+        Repository.objects.values("name")
+        .annotate(copies=Count("id"))
+        .filter(copies__gt=1)
+        .values_list("name", flat=True)
+    )
+    for name in list(names):
+        for repo in Repository.objects.filter(name=name).order_by("id")[1:]:
+            repo.name = f"{name}#{repo.id}"
+            repo.enabled = False
+            repo.save(update_fields=["name", "enabled"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0014_repository_mirror_durations"),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="repository",
+            name="name",
+            field=models.CharField(max_length=512, unique=True),
+        ),
+    ]
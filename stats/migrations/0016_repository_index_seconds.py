@@ -0,0 +1,18 @@
+# Generated by Django 4.0.7 on 2026-10-18 13:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0015_repository_unique_name"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="repository",
+            name="index_seconds",
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.0.7 on 2026-10-18 13:15
+
+import datetime
+
+from django.db import migrations, models
+from django.utils.timezone import utc
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0016_repository_index_seconds"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="repository",
+            name="index_interval",
+            field=models.DurationField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="repository",
+            name="next_index_at",
+            field=models.DateTimeField(
+                default=datetime.datetime(1970, 1, 1, 0, 0, tzinfo=utc)
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="repository",
+            index=models.Index(
+                fields=["status", "enabled", "next_index_at"], name="stats_repo_due_idx"
+            ),
+        ),
+    ]
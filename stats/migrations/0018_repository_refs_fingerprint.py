@@ -0,0 +1,18 @@
+# Generated by Django 4.0.7 on 2026-10-18 13:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0017_repository_next_index_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="repository",
+            name="refs_fingerprint",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
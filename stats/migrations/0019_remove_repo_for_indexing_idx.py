@@ -0,0 +1,17 @@
+# Generated by Django 4.0.7 on 2026-10-18 14:20
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0018_repository_refs_fingerprint"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="repository",
+            name="stats_repo_for_indexing_idx",
+        ),
+    ]
@@ -0,0 +1,116 @@
+# Generated by Django 4.0.7 on 2026-10-18 15:05
+
+from django.db import migrations, models
+from django.db.models import Case, Count, F, Q, Sum, When
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+
+
+def alias_duplicates(apps, schema_editor):
+    """
+    emails were not unique before, concurrent index runs could create the
+    same author twice. the oldest author keeps the email, the others are
+    renamed and become its aliases, so their commits count for it
+    """
+    Author = apps.get_model("stats", "Author")
+    emails = (
+        Author.objects.values("email")
+        .annotate(copies=Count("id"))
+        .filter(copies__gt=1)
+        .values_list("email", flat=True)
+    )
+    originals = set()
+    for email in list(emails):
+        original, *duplicates = Author.objects.filter(email=email).order_by("id")
+        originals.add(original.original_id if original.is_alias else original.id)
+        for author in duplicates:
+            suffix = f"#{author.id}"
+            author.email = email[: 64 - len(suffix)] + suffix
+            author.is_alias = True
+            author.original_id = author.original_id or original.id
+            author.save(update_fields=["email", "is_alias", "original", "updated_at"])
+    if originals:
+        rebuild_rollups(apps, originals)
+
+
+def rebuild_rollups(apps, authors):
+    """same as stats.rollups.rebuild_author_rollups, with the models of now"""
+    Author = apps.get_model("stats", "Author")
+    Commit = apps.get_model("stats", "Commit")
+    CommitRollup = apps.get_model("stats", "CommitRollup")
+    aliases = Author.objects.filter(original_id__in=authors).values_list(
+        "id", flat=True
+    )
+    CommitRollup.objects.filter(author_id__in=authors | set(aliases)).delete()
+    commits = Commit.objects.filter(
+        Q(author_id__in=authors)
+        | Q(author__is_alias=True, author__original_id__in=authors)
+    )
+    periods = {"day": TruncDay, "week": TruncWeek, "month": TruncMonth}
+    for period, trunc in periods.items():
+        rows = (
+            commits.annotate(
+                bucket=trunc("created_at", output_field=models.DateField()),
+                rollup_author=Case(
+                    When(
+                        author__is_alias=True,
+                        author__original__isnull=False,
+                        then=F("author__original_id"),
+                    ),
+                    default=F("author_id"),
+                ),
+            )
+            .values("bucket", "rollup_author", "repo_id")
+            .annotate(
+                total_added=Sum("lines_added"),
+                total_removed=Sum("lines_removed"),
+                total_commits=Count("id"),
+                total_merges=Count("id", filter=Q(is_merge=True)),
+            )
+            .order_by()
+        )
+        CommitRollup.objects.bulk_create(
+            (
+                CommitRollup(
+                    period=period,
+                    bucket=row["bucket"],
+                    author_id=row["rollup_author"],
+                    repo_id=row["repo_id"],
+                    lines_added=row["total_added"],
+                    lines_removed=row["total_removed"],
+                    commit_count=row["total_commits"],
+                    merge_commit_count=row["total_merges"],
+                )
+                for row in rows.iterator()
+            ),
+            batch_size=5000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0019_remove_repo_for_indexing_idx"),
+    ]
+
+    operations = [
+        migrations.RunPython(alias_duplicates, migrations.RunPython.noop),
+        # a plain unique index, adding a constraint would make sqlite rebuild
+        # stats_author, which stats_author_stats_view depends on
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    "create unique index stats_author_email_uniq"
+                    " on stats_author (email)",
+                    "drop index stats_author_email_uniq",
+                ),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name="author",
+                    constraint=models.UniqueConstraint(
+                        fields=["email"], name="stats_author_email_uniq"
+                    ),
+                ),
+            ],
+        ),
+    ]
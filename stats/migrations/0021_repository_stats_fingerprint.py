@@ -0,0 +1,18 @@
+# Generated by Django 4.0.7 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stats", "0020_author_email_uniq"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="repository",
+            name="stats_fingerprint",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
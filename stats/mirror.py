@@ -0,0 +1,219 @@
+# bare mirrors of the remote repositories under GIT_MIRROR_DIR, kept up to
+# date with git fetch --prune so that indexing a remote repository only
+# downloads the commits pushed since the last run
+#
+# mirrors are laid out as <host>/<path of the repo>.git. the objects of the
+# mirrors of a host are kept once, in the shared object store
+# .shared/<host>.git that every mirror of the host borrows from through
+# objects/info/alternates, so forks share the objects they have in common.
+# a fetch only downloads the objects the store doesn't have yet, they are
+# then moved into the store together with the refs of the mirror, under
+# refs/mirrors/<key>/, so the store reaches every object a mirror needs.
+# git never prunes the store by itself, gc_mirrors does while none of the
+# mirrors of the host are updated
+#
+import fcntl
+import glob
+import hashlib
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from typing import NamedTuple
+from urllib.parse import urlparse
+
+from django.conf import settings
+from git import Repo
+
+# only branches and tags are indexed, skip refs like refs/pull/* or
+# refs/merge-requests/* that git clone --mirror would download
+FETCH_REFSPECS = ["+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*"]
+
+# directory of the shared object stores, under GIT_MIRROR_DIR. host names
+# don't start with a dot, it can't be the directory of a host
+SHARED_DIR = ".shared"
+
+
+class MirrorUpdate(NamedTuple):
+    path: str
+    cloned: bool
+    seconds: float
+
+
+def mirror_path(repo_url: str) -> str:
+    """local path of the mirror of repo_url"""
+    if "://" in repo_url:
+        url = urlparse(repo_url)
+        host, path = url.hostname or "localhost", url.path
+    else:
+        # scp like syntax, git@host:group/repo.git
+        host, path = repo_url.split("@", 1)[-1].split(":", 1)
+    parts = [part for part in path.split("/") if part not in ("", ".", "..")]
+    name = "/".join(parts)
+    if name.endswith(".git"):
+        name = name[:-4]
+    return os.path.join(settings.GIT_MIRROR_DIR, host, f"{name}.git")
+
+
+def shared_store_path(host: str) -> str:
+    """local path of the object store shared by the mirrors of the host"""
+    return os.path.join(settings.GIT_MIRROR_DIR, SHARED_DIR, f"{host}.git")
+
+
+def update_mirror(repo_url: str) -> MirrorUpdate:
+    """
+    create the mirror of repo_url or fetch the changes since the last
+    update, refs deleted upstream are pruned
+    """
+    path = mirror_path(repo_url)
+    store = _open_store(_host_of(path))
+    # gc_mirrors waits for the updates of the mirrors of the host
+    with _lock(store, fcntl.LOCK_SH), _lock(path):
+        start = time.perf_counter()
+        cloned = not os.path.isdir(path)
+        if cloned:
+            repo = _init_mirror(path, repo_url)
+        else:
+            repo = Repo(path)
+            # the url can change, e.g. when the repo is moved to another group
+            repo.git.config("remote.origin.url", repo_url)
+        try:
+            # also mirrors created before the store start borrowing from it
+            _borrow(repo, store)
+            repo.git.fetch("origin", prune=True, no_tags=True)
+            _share_objects(repo, store)
+        except Exception:
+            if cloned:
+                # start over on the next update rather than from a mirror
+                # that may miss objects
+                shutil.rmtree(path, ignore_errors=True)
+            raise
+        finally:
+            repo.close()
+    return MirrorUpdate(path, cloned, time.perf_counter() - start)
+
+
+def gc_mirrors() -> list:
+    """
+    gc the shared object store of every host, the objects no mirror of the
+    host reaches anymore, e.g. of deleted mirrors, are pruned. the updates
+    of the mirrors of the host wait until it is done. return the hosts
+    """
+    hosts = []
+    for store in sorted(glob.glob(shared_store_path("*"))):
+        host = os.path.basename(store)[: -len(".git")]
+        with _lock(store):
+            _gc_store(host, store)
+        hosts.append(host)
+    return hosts
+
+
+def _gc_store(host, store):
+    store_repo = Repo(store)
+    try:
+        keys = set()
+        for path in _host_mirrors(host):
+            repo = Repo(path)
+            try:
+                # objects of a mirror whose last update failed halfway
+                _share_objects(repo, store)
+            finally:
+                repo.close()
+            keys.add(_mirror_key(path))
+        for ref in store_repo.git.for_each_ref(
+            "refs/mirrors/", format="%(refname)"
+        ).splitlines():
+            if ref.split("/")[2] not in keys:
+                store_repo.git.update_ref("-d", ref)
+        store_repo.git.gc(prune="now")
+    finally:
+        store_repo.close()
+
+
+def _host_mirrors(host):
+    """the mirrors of the host, every bare repository under its directory"""
+    for root, dirs, _ in os.walk(os.path.join(settings.GIT_MIRROR_DIR, host)):
+        if root.endswith(".git") and os.path.isdir(os.path.join(root, "objects")):
+            dirs.clear()
+            yield root
+
+
+def _host_of(path):
+    return os.path.relpath(path, settings.GIT_MIRROR_DIR).split(os.sep)[0]
+
+
+def _mirror_key(path):
+    """
+    name of the refs of the mirror in the shared store, paths can have
+    parts that refs can't, e.g. a leading dot
+    """
+    name = os.path.relpath(path, settings.GIT_MIRROR_DIR)
+    return hashlib.sha1(name.encode()).hexdigest()
+
+
+def _open_store(host):
+    store = shared_store_path(host)
+    if not os.path.isdir(store):
+        with _lock(store):
+            if not os.path.isdir(store):
+                repo = Repo.init(store, bare=True, mkdir=True)
+                # objects only mirrors reach are kept until gc_mirrors
+                repo.git.config("gc.pruneExpire", "never")
+                repo.git.config("fetch.unpackLimit", "1")
+                repo.close()
+    return store
+
+
+def _init_mirror(path, repo_url):
+    repo = Repo.init(path, bare=True, mkdir=True)
+    repo.git.config("remote.origin.url", repo_url)
+    for refspec in FETCH_REFSPECS:
+        repo.git.config("remote.origin.fetch", refspec, add=True)
+    return repo
+
+
+def _borrow(repo, store):
+    """make the mirror borrow the objects of the shared store"""
+    alternates = _alternates(repo.git_dir)
+    objects = os.path.join(os.path.abspath(store), "objects")
+    if not os.path.exists(alternates):
+        with open(alternates, "w") as f:
+            f.write(objects + "\n")
+        # fetched objects stay in a pack that _share_objects drops whole
+        repo.git.config("fetch.unpackLimit", "1")
+
+
+def _share_objects(repo, store):
+    """
+    copy the objects of the mirror that the store doesn't have into it,
+    with the refs of the mirror, then drop the mirror's own copy
+    """
+    key = _mirror_key(repo.git_dir)
+    refspecs = [
+        f"+refs/{kind}/*:refs/mirrors/{key}/{kind}/*" for kind in ("heads", "tags")
+    ]
+    store_repo = Repo(store)
+    try:
+        store_repo.git.fetch(
+            os.path.abspath(repo.git_dir), *refspecs, prune=True, no_tags=True
+        )
+    finally:
+        store_repo.close()
+    # -l leaves out the objects found in the store
+    repo.git.repack(a=True, d=True, l=True)
+
+
+def _alternates(path):
+    return os.path.join(path, "objects", "info", "alternates")
+
+
+@contextmanager
+def _lock(path, operation=fcntl.LOCK_EX):
+    """serialize updates of a mirror, or a shared store, across processes"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.lock", "w") as f:
+        fcntl.flock(f, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -1,9 +1,11 @@
 from configparser import ConfigParser
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from typing import Optional
 
+from django.conf import settings
 from django.db import models
 
-from .utils import is_remote_git_url
+from .utils import ShaSet, is_remote_git_url
 
 EPOCH_ZERO = datetime(1970, 1, 1, tzinfo=timezone.utc)
 
@@ -74,14 +76,20 @@ class AuthorStat(models.Model):
 
 
 class Author(models.Model):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["email"], name="stats_author_email_uniq"),
+        ]
+
     name = models.CharField(max_length=64)
-    email = models.CharField(max_length=64)
+    email = models.CharField(max_length=64, db_index=True)
     tag1 = models.CharField(max_length=16, null=True, blank=True)
     tag2 = models.CharField(max_length=16, null=True, blank=True)
     tag3 = models.CharField(max_length=16, null=True, blank=True)
     is_alias = models.BooleanField(default=False)
     original = models.ForeignKey("self", null=True, on_delete=models.PROTECT)
     stats = models.OneToOneField(AuthorStat, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.name} <{self.email}>"
@@ -103,16 +111,97 @@ class Author(models.Model):
             return author.original if author.is_alias else author
 
 
+class AuthorResolver:
+    """
+    in memory lookup of the canonical author for a commit email, owned
+    by one indexing run. all authors are loaded with a single query,
+    authors seen for the first time are created in bulk by flush(), and
+    the cache is reloaded once any author is edited after it was loaded,
+    e.g. when an alias is set up in the admin.
+    """
+
+    def __init__(self):
+        self.load()
+
+    def load(self):
+        self.loaded_at = datetime.now().astimezone()
+        authors = {author.id: author for author in Author.objects.all()}
+        self._by_email = {}
+        for author in authors.values():
+            # if author is an alias, use the original
+            if author.is_alias and author.original_id in authors:
+                self._by_email[author.email] = authors[author.original_id]
+            else:
+                self._by_email[author.email] = author
+        self._pending = []
+
+    def locate(self, name: str, email: str):
+        author = self._by_email.get(email)
+        if author is None:
+            author = Author(name=name, email=email, is_alias=False, stats=AuthorStat())
+            self._by_email[email] = author
+            self._pending.append(author)
+        return author
+
+    def flush(self):
+        """save the new authors returned by locate() since the last flush"""
+        is_stale = Author.objects.filter(updated_at__gt=self.loaded_at).exists()
+        if self._pending:
+            # other runs may have created some of them since the cache was
+            # loaded, the commits are pointed at the existing rows instead
+            pending = {author.email: author for author in self._pending}
+            self._adopt_existing(pending)
+            new = [author for author in pending.values() if author.id is None]
+            AuthorStat.objects.bulk_create([author.stats for author in new])
+            # a run inserting the same email in between loses to it, the
+            # unique index on email keeps a single row
+            Author.objects.bulk_create(new, ignore_conflicts=True)
+            created = self._adopt_existing(pending)
+            orphans = [a.stats.id for a in new if a.email not in created]
+            AuthorStat.objects.filter(id__in=orphans).delete()
+            for author in created.values():
+                print(f"created new {author}")
+            if created:
+                self.loaded_at = max(a.updated_at for a in created.values())
+            self._pending = []
+        if is_stale:
+            self.load()
+
+    def _adopt_existing(self, pending) -> dict:
+        """
+        give the pending authors that are now in the database the id of
+        their row, or of its original for an alias. return the rows that
+        were inserted by this resolver
+        """
+        emails = [email for email, author in pending.items() if author.id is None]
+        created = {}
+        for row in Author.objects.filter(email__in=emails).select_related("original"):
+            author = pending[row.email]
+            if row.stats_id == author.stats.id:
+                created[row.email] = row
+            canonical = row.original if row.is_alias and row.original else row
+            author.id = canonical.id
+            self._by_email[row.email] = canonical
+        return created
+
+
 class Repository(models.Model):
     class Meta:
         verbose_name_plural = "Repositories"
+        indexes = [
+            # plan_indexing
+            models.Index(
+                fields=["status", "enabled", "next_index_at"],
+                name="stats_repo_due_idx",
+            ),
+        ]
 
     class RepoStatus(models.TextChoices):
         READY = "Ready"
         INUSE = "InUse"
         ERROR = "Error"
 
-    name = models.CharField(max_length=512)
+    name = models.CharField(max_length=512, unique=True)
     type = models.CharField(max_length=16, null=True, blank=True)  # noqa: A003,VNE003,
     tag1 = models.CharField(max_length=16, null=True, blank=True)
     tag2 = models.CharField(max_length=16, null=True, blank=True)
@@ -127,6 +216,20 @@ class Repository(models.Model):
     last_status_at = models.DateTimeField(default=EPOCH_ZERO)
     last_error = models.TextField(null=True, blank=True)
     last_commit_at = models.DateTimeField(default=EPOCH_ZERO)
+    # the crawler.ini section the repo was discovered from
+    section = models.CharField(max_length=64, null=True, blank=True)
+    # seconds spent cloning and last fetching the mirror of a remote repo
+    clone_seconds = models.FloatField(null=True, blank=True)
+    fetch_seconds = models.FloatField(null=True, blank=True)
+    # seconds the last successful index_repository took
+    index_seconds = models.FloatField(null=True, blank=True)
+    # when plan_indexing schedules the repo next, see schedule_next_index
+    next_index_at = models.DateTimeField(default=EPOCH_ZERO)
+    index_interval = models.DurationField(null=True, blank=True)
+    # refs_fingerprint of the repo when it was last indexed
+    refs_fingerprint = models.CharField(max_length=64, null=True, blank=True)
+    # settings_fingerprint the stats of the stored commits were computed with
+    stats_fingerprint = models.CharField(max_length=64, null=True, blank=True)
 
     def set_status(self, status, errmsg=None, last_commit_dt=None):
         self.status = status
@@ -136,30 +239,141 @@ class Repository(models.Model):
             self.last_commit_at = last_commit_dt
         self.save()
 
-    def all_commit_hash(self):
+    def schedule_next_index(self, new_commits: int, now=None) -> None:
+        """
+        poll again soon after a run that found commits and back off
+        exponentially while runs find none, up to INDEX_MAX_INTERVAL. a repo
+        is never left longer than INDEX_RECENCY_FACTOR times the time its
+        next commit is expected in, the mean time between its recent commits,
+        or the age of its last commit when it has none. recently active repos
+        are polled often and a repo dormant for years only once every
+        INDEX_MAX_INTERVAL
+        """
+        now = now or datetime.now().astimezone()
+        shortest = timedelta(minutes=settings.INDEX_INTERVAL)
+        longest = timedelta(minutes=settings.INDEX_MAX_INTERVAL)
+        expected = self.mean_commit_gap(now) or now - self.last_commit_at
+        target = max(shortest, min(longest, expected * settings.INDEX_RECENCY_FACTOR))
+        if self.index_interval is None:
+            # first schedule, e.g. a repo indexed for the first time
+            interval = target
+        elif new_commits:
+            interval = shortest
+        else:
+            interval = min(self.index_interval * 2, target)
+        self.index_interval = max(shortest, interval)
+        self.next_index_at = now + self.index_interval
+
+    def mean_commit_gap(self, now=None) -> Optional[timedelta]:
+        """
+        mean time between the commits of the last INDEX_RATE_DAYS days,
+        from the daily rollups, None when there are none
+        """
+        now = now or datetime.now().astimezone()
+        window = timedelta(days=settings.INDEX_RATE_DAYS)
+        commits = CommitRollup.objects.filter(
+            repo=self,
+            period=CommitRollup.Period.DAY,
+            bucket__gt=(now - window).date(),
+        ).aggregate(total=models.Sum("commit_count"))["total"]
+        return window / commits if commits else None
+
+    def save_mirror_update(self, update) -> None:
+        """record how long the last update_mirror of the repo took"""
+        if update.cloned:
+            self.clone_seconds = update.seconds
+        self.fetch_seconds = update.seconds
+        self.save(update_fields=["clone_seconds", "fetch_seconds"])
+
+    def all_commit_hash(self) -> ShaSet:
         """return hash of all commits for a repo"""
-        all_commits = Commit.objects.filter(repo=self).all()
-        return dict([(c.sha, c.author.id) for c in all_commits])  # noqa: C404
+        shas = Commit.objects.filter(repo=self).values_list("sha", flat=True)
+        return ShaSet(shas.iterator(chunk_size=10000))
+
+    def ref_bookmarks(self) -> dict:
+        """return the tip of each ref when the repo was last indexed"""
+        return dict(self.refbookmark_set.values_list("ref", "sha"))
+
+    def save_ref_bookmarks(self, tips: dict) -> None:
+        """remember the tip of each ref that has been indexed"""
+        bookmarks = {bookmark.ref: bookmark for bookmark in self.refbookmark_set.all()}
+        removed = [
+            bookmark.id for ref, bookmark in bookmarks.items() if ref not in tips
+        ]
+        changed, added = [], []
+        for ref, sha in tips.items():
+            bookmark = bookmarks.get(ref)
+            if bookmark is None:
+                added.append(RefBookmark(repo=self, ref=ref, sha=sha))
+            elif bookmark.sha != sha:
+                bookmark.sha = sha
+                changed.append(bookmark)
+        RefBookmark.objects.filter(id__in=removed).delete()
+        RefBookmark.objects.bulk_update(changed, ["sha"])
+        RefBookmark.objects.bulk_create(added)
 
     @staticmethod
-    def register(name, repo_url, repo_type, gitweb_base_url):
-        repo = Repository.objects.filter(name=name).first()
-        if repo:
-            return repo
-        web_url = gitweb_base_url.replace("$name", name) if gitweb_base_url else None
-        repo = Repository(
-            name=name,
-            is_remote=is_remote_git_url(repo_url),
-            repo_url=repo_url,
-            type=repo_type,
-            gitweb_base_url=web_url,
-        )
-        repo.save()
-        print(f"registering new repo {name} => {name}")
-        return repo
+    def register_all(discovered) -> int:
+        """
+        register the discovered repositories, given as the keyword arguments
+        of the old register call, in bulk. the urls and section of known
+        repos are updated when they changed. a name discovered more than
+        once keeps its first occurrence. return the number of new repos
+        """
+        found = {}
+        for params in discovered:
+            found.setdefault(params["name"], params)
+
+        existing = {repo.name: repo for repo in Repository.objects.all()}
+        fields = ["repo_url", "gitweb_base_url", "is_remote", "section"]
+        new, changed = [], []
+        for name, params in found.items():
+            gitweb_base_url = params.get("gitweb_base_url")
+            values = {
+                "repo_url": params["repo_url"],
+                "gitweb_base_url": gitweb_base_url.replace("$name", name)
+                if gitweb_base_url
+                else None,
+                "is_remote": is_remote_git_url(params["repo_url"]),
+                "section": params.get("section"),
+            }
+            repo = existing.get(name)
+            if repo is None:
+                new.append(Repository(name=name, type=params["repo_type"], **values))
+                print(f"registering new repo {name} => {params['repo_url']}")
+            elif any(getattr(repo, field) != values[field] for field in fields):
+                for field in fields:
+                    setattr(repo, field, values[field])
+                changed.append(repo)
+
+        # repos registered concurrently by another discovery are skipped
+        Repository.objects.bulk_create(new, batch_size=1000, ignore_conflicts=True)
+        Repository.objects.bulk_update(changed, fields, batch_size=1000)
+        return len(new)
+
+
+class RefBookmark(models.Model):
+    """the commit a ref pointed to when its repository was last indexed"""
+
+    class Meta:
+        unique_together = [["repo", "ref"]]
+
+    repo = models.ForeignKey(Repository, on_delete=models.CASCADE)
+    ref = models.CharField(max_length=512)
+    sha = models.CharField(max_length=40)
 
 
 class Commit(models.Model):
+    class Meta:
+        # on postgres the partitioned table's constraint of this name also
+        # includes created_at, see 0013_partition_commit, and save_commits
+        # skips the commits already stored for the repository instead
+        constraints = [
+            models.UniqueConstraint(
+                fields=["repo", "sha"], name="stats_commit_repo_sha_uniq"
+            ),
+        ]
+
     sha = models.CharField(max_length=40)
     message = models.CharField(max_length=2048)
     lines_added = models.IntegerField()
@@ -167,8 +381,35 @@ class Commit(models.Model):
     lines_of_code = models.IntegerField()
     is_merge = models.BooleanField(default=False)
     author = models.ForeignKey(Author, on_delete=models.PROTECT)
-    created_at = models.DateTimeField()
+    created_at = models.DateTimeField(db_index=True)
+    repo = models.ForeignKey(Repository, on_delete=models.PROTECT)
+    indexed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class CommitRollup(models.Model):
+    """
+    commits aggregated per day, week or month, author and repository,
+    maintained by the indexer so trend queries don't scan stats_commit.
+    buckets start at the beginning of the period in TIME_ZONE, weeks
+    start on Monday
+    """
+
+    class Meta:
+        unique_together = [["period", "bucket", "author", "repo"]]
+
+    class Period(models.TextChoices):
+        DAY = "day"
+        WEEK = "week"
+        MONTH = "month"
+
+    period = models.CharField(max_length=8, choices=Period.choices)
+    bucket = models.DateField()
+    author = models.ForeignKey(Author, on_delete=models.PROTECT)
     repo = models.ForeignKey(Repository, on_delete=models.PROTECT)
+    lines_added = models.IntegerField(default=0)
+    lines_removed = models.IntegerField(default=0)
+    commit_count = models.IntegerField(default=0)
+    merge_commit_count = models.IntegerField(default=0)
 
 
 class Job(models.Model):
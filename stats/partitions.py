@@ -0,0 +1,113 @@
+# monthly partitions of stats_commit by created_at on postgres, set up by
+# migration 0013_partition_commit. other databases keep a single table.
+#
+# a partition is created for each month before commits of that month are
+# inserted. commits that reach the default partition anyway, e.g. written
+# by other tools, are moved when their month's partition is created
+#
+from datetime import datetime, timezone
+
+from django.db import connection
+
+DEFAULT_PARTITION = "stats_commit_default"
+
+# any constant, serializes the creation of partitions by concurrent indexers
+PARTITION_LOCK_ID = 20130
+
+
+def partition_name(month) -> str:
+    return f"stats_commit_p{month:%Y%m}"
+
+
+def month_of(dt) -> datetime:
+    """start of the month in UTC the partition of dt covers"""
+    dt = dt.astimezone(timezone.utc)
+    return datetime(dt.year, dt.month, 1, tzinfo=timezone.utc)
+
+
+def next_month(month) -> datetime:
+    return month.replace(
+        year=month.year + month.month // 12, month=month.month % 12 + 1
+    )
+
+
+def commit_partitions(cur) -> dict:
+    """return the monthly partitions attached to stats_commit, as {month: name}"""
+    cur.execute(
+        """
+        select child.relname
+        from pg_inherits
+        join pg_class parent on parent.oid = pg_inherits.inhparent
+        join pg_class child on child.oid = pg_inherits.inhrelid
+        where parent.relname = 'stats_commit' and child.relname like %s
+        """,
+        ["stats_commit_p%"],
+    )
+    partitions = {}
+    for (name,) in cur.fetchall():
+        month = datetime.strptime(name[-6:], "%Y%m").replace(tzinfo=timezone.utc)
+        partitions[month] = name
+    return partitions
+
+
+def create_partition(cur, month) -> str:
+    """create and attach the partition of the month, must run in a transaction"""
+    name = partition_name(month)
+    bounds = [month, next_month(month)]
+    cur.execute(f"create table {name} (like stats_commit including defaults)")
+    cur.execute(
+        f"""
+        with moved as (
+            delete from {DEFAULT_PARTITION}
+            where created_at >= %s and created_at < %s
+            returning *
+        )
+        insert into {name} select * from moved
+        """,
+        bounds,
+    )
+    cur.execute(
+        f"alter table stats_commit attach partition {name}"
+        " for values from (%s) to (%s)",
+        bounds,
+    )
+    return name
+
+
+def ensure_commit_partitions(created_at) -> None:
+    """
+    create the missing partitions for commits created at the given times,
+    in the transaction that inserts them
+    """
+    if connection.vendor != "postgresql":
+        return
+    months = {month_of(dt) for dt in created_at}
+    with connection.cursor() as cur:
+        # the catalog is checked on every batch, partitions can be detached
+        # or dropped by other processes at any time
+        if not months - commit_partitions(cur).keys():
+            return
+        cur.execute("select pg_advisory_xact_lock(%s)", [PARTITION_LOCK_ID])
+        for month in sorted(months - commit_partitions(cur).keys()):
+            print(f"creating partition {create_partition(cur, month)}")
+
+
+def detach_commit_partitions(before) -> list:
+    """
+    detach the partitions of the months that end on or before the given
+    time. detaching doesn't copy any data, the detached tables are left
+    in place to be archived or dropped. they are renamed with the time of
+    detaching, so that the partition of the month can be created again
+    when older commits are indexed later
+    """
+    if connection.vendor != "postgresql":
+        return []
+    detached = []
+    suffix = f"d{datetime.now(timezone.utc):%Y%m%d%H%M%S}"
+    with connection.cursor() as cur:
+        for month, name in sorted(commit_partitions(cur).items()):
+            if next_month(month) <= before:
+                cur.execute(f"alter table stats_commit detach partition {name}")
+                cur.execute(f"alter table {name} rename to {name}_{suffix}")
+                detached.append(f"{name}_{suffix}")
+    return detached
@@ -0,0 +1,196 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, DateField, F, Q, Sum, When
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import Author, Commit, CommitRollup
+
+PERIODS = {
+    CommitRollup.Period.DAY: TruncDay,
+    CommitRollup.Period.WEEK: TruncWeek,
+    CommitRollup.Period.MONTH: TruncMonth,
+}
+
+# dimensions the rollups can be grouped by in commit_rollups
+GROUP_BY = {
+    "author": "author__email",
+    "author_tag": "author__tag1",
+    "repo": "repo__name",
+    "repo_tag": "repo__tag1",
+}
+
+UPSERT_SQL = """
+insert into stats_commitrollup
+    (period, bucket, author_id, repo_id,
+     lines_added, lines_removed, commit_count, merge_commit_count)
+values (%s, %s, %s, %s, %s, %s, %s, %s)
+on conflict (period, bucket, author_id, repo_id) do update
+set
+    lines_added = stats_commitrollup.lines_added + excluded.lines_added,
+    lines_removed = stats_commitrollup.lines_removed + excluded.lines_removed,
+    commit_count = stats_commitrollup.commit_count + excluded.commit_count,
+    merge_commit_count =
+        stats_commitrollup.merge_commit_count + excluded.merge_commit_count
+"""
+
+
+def bucket_of(period, day):
+    """first day of the period the day falls in, same as the Trunc functions"""
+    if period == CommitRollup.Period.WEEK:
+        return day - timedelta(days=day.weekday())
+    if period == CommitRollup.Period.MONTH:
+        return day.replace(day=1)
+    return day
+
+
+def update_commit_rollups(commits) -> None:
+    """add newly saved commits to the rollups of every period"""
+    totals = defaultdict(lambda: [0, 0, 0, 0])
+    for commit in commits:
+        day = timezone.localtime(commit.created_at).date()
+        for period in PERIODS:
+            key = (period, bucket_of(period, day))
+            row = totals[key + (commit.author_id, commit.repo_id)]
+            row[0] += commit.lines_added
+            row[1] += commit.lines_removed
+            row[2] += 1
+            row[3] += 1 if commit.is_merge else 0
+    if not totals:
+        return
+
+    adapt = connection.ops.adapt_datefield_value
+    with connection.cursor() as cur:
+        cur.executemany(
+            UPSERT_SQL,
+            [
+                [period, adapt(bucket), author_id, repo_id, *row]
+                for (period, bucket, author_id, repo_id), row in totals.items()
+            ],
+        )
+
+
+def rebuild_commit_rollups() -> None:
+    """recompute all rollups from the commits"""
+    with transaction.atomic():
+        CommitRollup.objects.all().delete()
+        _create_rollups(Commit.objects.all())
+
+
+def rebuild_author_rollups(author_ids) -> None:
+    """
+    recompute the rollups of the authors, e.g. after one of them is made
+    an alias of another. the commits of an alias count for its original,
+    also the ones indexed before the alias was set up
+    """
+    authors = set(author_ids)
+    authors |= set(
+        Author.objects.filter(id__in=authors, is_alias=True)
+        .exclude(original=None)
+        .values_list("original_id", flat=True)
+    )
+    aliases = Author.objects.filter(original_id__in=authors).values_list(
+        "id", flat=True
+    )
+    with transaction.atomic():
+        CommitRollup.objects.filter(author_id__in=authors | set(aliases)).delete()
+        _create_rollups(
+            Commit.objects.filter(
+                Q(author_id__in=authors)
+                | Q(author__is_alias=True, author__original_id__in=authors)
+            )
+        )
+
+
+def rebuild_repository_rollups(repo_id) -> None:
+    """
+    recompute the rollups of the repo, e.g. after the stats of its commits
+    are computed again with other settings
+    """
+    with transaction.atomic():
+        CommitRollup.objects.filter(repo_id=repo_id).delete()
+        _create_rollups(Commit.objects.filter(repo_id=repo_id))
+
+
+def _rollup_author():
+    """the author commits are rolled up under, the original of an alias"""
+    return Case(
+        When(
+            author__is_alias=True,
+            author__original__isnull=False,
+            then=F("author__original_id"),
+        ),
+        default=F("author_id"),
+    )
+
+
+def _create_rollups(commits):
+    for period, trunc in PERIODS.items():
+        rows = (
+            commits.annotate(
+                bucket=trunc("created_at", output_field=DateField()),
+                rollup_author=_rollup_author(),
+            )
+            .values("bucket", "rollup_author", "repo_id")
+            .annotate(
+                total_added=Sum("lines_added"),
+                total_removed=Sum("lines_removed"),
+                total_commits=Count("id"),
+                total_merges=Count("id", filter=Q(is_merge=True)),
+            )
+            .order_by()
+        )
+        CommitRollup.objects.bulk_create(
+            (
+                CommitRollup(
+                    period=period,
+                    bucket=row["bucket"],
+                    author_id=row["rollup_author"],
+                    repo_id=row["repo_id"],
+                    lines_added=row["total_added"],
+                    lines_removed=row["total_removed"],
+                    commit_count=row["total_commits"],
+                    merge_commit_count=row["total_merges"],
+                )
+                for row in rows.iterator()
+            ),
+            batch_size=5000,
+        )
+
+
+def commit_rollups(period, since=None, until=None, group_by=(), **filters):
+    """
+    totals per bucket of the period between since and until, inclusive,
+    further split by the GROUP_BY dimensions in group_by. filters are
+    applied to the rollups, e.g. repo__tag1="team-a"
+    """
+    fields = [GROUP_BY[name] for name in group_by]
+    rollups = CommitRollup.objects.filter(period=period, **filters)
+    if since:
+        rollups = rollups.filter(bucket__gte=bucket_of(period, since))
+    if until:
+        rollups = rollups.filter(bucket__lte=until)
+    rows = (
+        rollups.values("bucket", *fields)
+        .annotate(
+            total_added=Sum("lines_added"),
+            total_removed=Sum("lines_removed"),
+            total_commits=Sum("commit_count"),
+            total_merges=Sum("merge_commit_count"),
+        )
+        .order_by("bucket", *fields)
+    )
+    # report the dimensions under their short names
+    return [
+        {
+            **{name: row[GROUP_BY[name]] for name in group_by},
+            "bucket": row["bucket"],
+            "lines_added": row["total_added"],
+            "lines_removed": row["total_removed"],
+            "commit_count": row["total_commits"],
+            "merge_commit_count": row["total_merges"],
+        }
+        for row in rows
+    ]
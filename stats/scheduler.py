@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.db import transaction
+
+from .gitrepo import repository_size
+from .models import EPOCH_ZERO, Repository
+
+
+class PlannedIndex(NamedTuple):
+    repo_id: int
+    name: str
+    queue: str
+    # seconds the last indexing took, None before the first one
+    cost: Optional[float]
+    last_commit_at: datetime
+
+
+def index_queue(repo) -> str:
+    """
+    queue of the workers that index the repo. a repo whose last indexing
+    took INDEX_LARGE_SECONDS or more goes to the large repo queue. a repo
+    never indexed has no cost yet, its first run walks its whole history,
+    it goes there when it stores INDEX_LARGE_KIB of objects or more. the
+    size of a remote repo is unknown until its mirror is cloned, it goes
+    to the default queue like repos indexed before their cost was recorded
+    """
+    if repo.index_seconds is None:
+        if repo.last_commit_at != EPOCH_ZERO:
+            return settings.INDEX_QUEUE
+        size = repository_size(repo.repo_url) if repo.repo_url else None
+        if size is not None and size >= settings.INDEX_LARGE_KIB:
+            return settings.INDEX_LARGE_QUEUE
+        return settings.INDEX_QUEUE
+    if repo.index_seconds >= settings.INDEX_LARGE_SECONDS:
+        return settings.INDEX_LARGE_QUEUE
+    return settings.INDEX_QUEUE
+
+
+def plan_indexing(now=None, lock=False) -> list:
+    """
+    the repositories due for indexing, see Repository.schedule_next_index,
+    in the order they should be sent. the small repos come first, the most
+    recently committed to first. large repos follow, the longest first,
+    they go to their own queue
+    """
+    now = now or datetime.now().astimezone()
+    repos = Repository.objects.filter(
+        status=Repository.RepoStatus.READY,
+        enabled=True,
+        next_index_at__lte=now,
+    ).only("id", "name", "repo_url", "index_seconds", "last_commit_at")
+    if lock:
+        repos = repos.select_for_update(skip_locked=True)
+
+    plan = [
+        PlannedIndex(
+            repo.id,
+            repo.name,
+            index_queue(repo),
+            repo.index_seconds,
+            repo.last_commit_at,
+        )
+        for repo in repos
+    ]
+    small = [p for p in plan if p.queue != settings.INDEX_LARGE_QUEUE]
+    large = [p for p in plan if p.queue == settings.INDEX_LARGE_QUEUE]
+    small.sort(key=lambda p: (-p.last_commit_at.timestamp(), p.repo_id))
+    # never indexed repos have no cost yet and go first
+    large.sort(key=lambda p: (p.cost is not None, -(p.cost or 0), p.repo_id))
+    return small + large
+
+
+def dispatch_indexing(now=None) -> list:
+    """
+    plan_indexing, and move the next_index_at of the planned repos
+    INDEX_DISPATCH_LEASE minutes ahead in the same transaction, so that
+    the next runs don't send them again while they wait in the queues.
+    index_repository schedules the repo for real, a repo whose task was
+    lost is sent again once the lease is over
+    """
+    now = now or datetime.now().astimezone()
+    lease = timedelta(minutes=settings.INDEX_DISPATCH_LEASE)
+    with transaction.atomic():
+        plan = plan_indexing(now, lock=True)
+        Repository.objects.filter(id__in=[p.repo_id for p in plan]).update(
+            next_index_at=now + lease
+        )
+    return plan
@@ -1,8 +1,7 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 
 from celery import chord
 from celery.schedules import crontab
-from django.utils import timezone
 
 from . import celery_app
 
@@ -23,32 +22,64 @@ def index_repository(self, **kwargs):
 
 @celery_app.task(bind=True, name="gather_author_stats")
 def gather_author_stats(self, group_output):
-    from stats.collector import populate_author_stats
+    from stats.collector import populate_author_stats, refresh_author_stats_view
 
     populate_author_stats()
+    refresh_author_stats_view()
+
+
+@celery_app.task(bind=True, name="refresh_author_stats")
+def refresh_author_stats(self, **kwargs):
+    from stats.collector import refresh_author_stats_view
+
+    refresh_author_stats_view()
+
+
+@celery_app.task(bind=True, name="rebuild_author_rollups")
+def rebuild_author_rollups(self, **kwargs):
+    from stats.rollups import rebuild_author_rollups
+
+    rebuild_author_rollups(kwargs["author_ids"])
 
 
 @celery_app.task(bind=True, name="index_all_repositories")
 def index_all_repositories(self, **kwargs):
-    from stats.indexer import repositories_for_indexing
+    from django.conf import settings
+
+    from stats.scheduler import dispatch_indexing
 
     # chord allows a task to be executed after all
-    # tasks ina group has completed
-    cut_off = timezone.make_aware(datetime.now() - timedelta(minutes=5))
-    chord(
-        [
-            index_repository.s(repo_id=repo.id)
-            for repo in repositories_for_indexing(cut_off=cut_off)
+    # tasks ina group has completed. large repos get their own chord so
+    # they don't hold back the author stats of all the others
+    plan = dispatch_indexing()
+    for queue in [settings.INDEX_QUEUE, settings.INDEX_LARGE_QUEUE]:
+        tasks = [
+            index_repository.s(repo_id=p.repo_id).set(queue=queue)
+            for p in plan
+            if p.queue == queue
         ]
-    )(gather_author_stats.s())
+        if tasks:
+            chord(tasks)(gather_author_stats.s())
+    return [p.name for p in plan]
 
 
 @celery_app.task(bind=True, name="analyze_all_repositories")
 def analyze_all_repositories(self, **kwargs):
     from stats.analyzer import analyze_all_repositories
 
+    def progress(done, total, eta):
+        meta = {"done": done, "total": total, "eta_seconds": round(eta)}
+        self.update_state(state="PROGRESS", meta=meta)
+
     timestamp = datetime.now().strftime("%y%m%d_%H%M%S")
-    analyze_all_repositories(f"tmp/stats_{timestamp}")
+    return analyze_all_repositories(f"tmp/stats_{timestamp}", progress=progress)
+
+
+@celery_app.task(bind=True, name="gc_mirrors")
+def gc_mirrors(self, **kwargs):
+    from stats.mirror import gc_mirrors
+
+    return gc_mirrors()
 
 
 @celery_app.on_after_finalize.connect
@@ -59,6 +90,13 @@ def setup_periodic_tasks(sender, **kwargs):
     )
 
     sender.add_periodic_task(
-        crontab(hour="*", minute="12", day_of_week="*"),
+        # only the repos that are due are indexed, see schedule_next_index
+        crontab(hour="*", minute="*/5", day_of_week="*"),
         index_all_repositories.s(),
     )
+
+    sender.add_periodic_task(
+        # the mirror updates of a host wait while its store is collected
+        crontab(hour="3", minute="17", day_of_week="sun"),
+        gc_mirrors.s(),
+    )
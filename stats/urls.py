@@ -4,4 +4,6 @@ from . import views
 
 urlpatterns = [
     path("repo", views.repo, name="repo"),
+    path("rollup", views.rollup, name="rollup"),
+    path("plan", views.plan, name="plan"),
 ]
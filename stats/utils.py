@@ -1,29 +1,73 @@
 import re
+from functools import lru_cache
 
 # files matches any of the regex will not be counted
-# towards commit stats
+# towards commit stats. can be replaced for a project by
+# setting ignore_patterns, one regex per line, in crawler.ini
 IGNORE_PATTERNS = [
-    re.compile(
-        "^(vendor|Pods|target|YoutuOCWrapper|vos-app-protection|vos-processor|\\.idea|\\.vscode)/."  # noqa: E501
-    ),
-    re.compile("^[a-zA-Z0-9_]*?/Pods/"),
-    re.compile("^.*(xcodeproj|xcworkspace)/."),
-    re.compile(".*\\.(jar|pbxproj|lock|bk|bak|backup|class|swp|sum)$"),
-    re.compile("package.*\\.json$"),
+    "^(vendor|Pods|target|YoutuOCWrapper|vos-app-protection|vos-processor|\\.idea|\\.vscode)/.",  # noqa: E501
+    "^[a-zA-Z0-9_]*?/Pods/",
+    "^.*(xcodeproj|xcworkspace)/.",
+    ".*\\.(jar|pbxproj|lock|bk|bak|backup|class|swp|sum)$",
+    "package.*\\.json$",
 ]
 
 GIT_REPO_PATTERN = re.compile("^(http://|https://|ssh://|git@).*.\\.git$")
 
 
+class PathMatcher:
+    """
+    matches a path against a list of regex in a single pass,
+    by merging them into one alternation. results are memoized
+    per path since the same paths are modified over and over
+    """
+
+    def __init__(self, patterns):
+        regex = re.compile("|".join(f"(?:{pattern})" for pattern in patterns))
+        self.match = lru_cache(maxsize=65536)(lambda path: bool(regex.match(path)))
+
+
+@lru_cache(maxsize=None)
+def path_matcher(patterns: tuple) -> PathMatcher:
+    return PathMatcher(patterns)
+
+
+def ignore_matcher(section=None) -> PathMatcher:
+    """
+    return the matcher of paths to ignore for a project section
+    of crawler.ini, or the default one
+    """
+    patterns = section.get("ignore_patterns") if section is not None else None
+    if not patterns:
+        return path_matcher(tuple(IGNORE_PATTERNS))
+    return path_matcher(tuple(p.strip() for p in patterns.splitlines() if p.strip()))
+
+
 def should_ignore_path(path: str) -> bool:
     """
     return true if the path should be ignore
     for calculating commit stats
     """
-    for regex in IGNORE_PATTERNS:
-        if regex.match(path):
-            return True
-    return False
+    return ignore_matcher().match(path)
+
+
+class ShaSet:
+    """
+    set of git commit hashes, stored as 20 byte binary digests
+    instead of 40 character strings to keep large repos compact
+    """
+
+    def __init__(self, shas=()):
+        self._digests = {bytes.fromhex(sha) for sha in shas}
+
+    def __contains__(self, sha: str) -> bool:
+        return bytes.fromhex(sha) in self._digests
+
+    def __len__(self) -> int:
+        return len(self._digests)
+
+    def add(self, sha: str) -> None:
+        self._digests.add(bytes.fromhex(sha))
 
 
 def is_remote_git_url(path) -> bool:
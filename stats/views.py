@@ -1,6 +1,11 @@
+from datetime import date
+
 from django.http import HttpResponse, JsonResponse
 
 from .indexer import active_repos
+from .models import CommitRollup
+from .rollups import GROUP_BY, commit_rollups
+from .scheduler import plan_indexing
 
 
 def repo(request):
@@ -11,6 +16,45 @@ def repo(request):
         return HttpResponse("Unauthorized", status=401)
 
 
+def rollup(request):
+    """
+    commit totals per period from the rollup tables, e.g.
+    /stats/rollup?period=week&since=2021-01-01&group_by=author_tag
+    """
+    if not is_authorized(request):
+        return HttpResponse("Unauthorized", status=401)
+
+    period = request.GET.get("period", CommitRollup.Period.WEEK)
+    group_by = [name for name in request.GET.get("group_by", "").split(",") if name]
+    if period not in CommitRollup.Period.values:
+        return HttpResponse(f"unknown period {period}", status=400)
+    if any(name not in GROUP_BY for name in group_by):
+        return HttpResponse(f"can only group by {', '.join(GROUP_BY)}", status=400)
+
+    filters = {}
+    if "repo_tag" in request.GET:
+        filters["repo__tag1"] = request.GET["repo_tag"]
+    if "author_tag" in request.GET:
+        filters["author__tag1"] = request.GET["author_tag"]
+    try:
+        since = request.GET.get("since")
+        since = date.fromisoformat(since) if since else None
+        until = request.GET.get("until")
+        until = date.fromisoformat(until) if until else None
+    except ValueError as e:
+        return HttpResponse(f"invalid date => {e}", status=400)
+
+    rows = commit_rollups(period, since, until, group_by, **filters)
+    return JsonResponse(rows, safe=False)
+
+
+def plan(request):
+    """the repositories the next index_all_repositories will send, in order"""
+    if not is_authorized(request):
+        return HttpResponse("Unauthorized", status=401)
+    return JsonResponse([p._asdict() for p in plan_indexing()], safe=False)
+
+
 def is_authorized(request):
     code = request.GET.get("code", "")
     return code == "s3cr3t"
@@ -21,3 +21,12 @@ def crawler_conf(tmp_path):
 
     conf["project.local"]["local_path"] = str(tmp_path)
     yield conf
+
+
+@pytest.fixture
+def local_conf(crawler_conf):
+    """crawler_conf with only the section of the local repositories"""
+    for key in crawler_conf.sections():
+        if key != "project.local":
+            crawler_conf.remove_section(key)
+    yield crawler_conf
@@ -14,3 +14,7 @@ if os.getenv("RUN_RUN_RUN", "") != "run":
             },
         }
     }
+
+# tests that use the commit cache point it to a temporary file
+COMMIT_CACHE_PATH = ""
+HTTP_CACHE_PATH = ""
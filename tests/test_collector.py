@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from stats.collector import populate_author_stats, refresh_author_stats_view
+from stats.indexer import index_repository, register_git_repositories
+from stats.models import AuthorAndStat, AuthorStat, Commit
+
+from .utils import create_some_commit, first_repo
+
+
+def author_stats():
+    return sorted(
+        AuthorStat.objects.values_list(
+            "id", "lines_added", "lines_removed", "commit_count", "merge_commit_count"
+        )
+    )
+
+
+@pytest.mark.django_db
+def test_populate_author_stats(local_conf):
+    register_git_repositories(local_conf)
+    repo = first_repo(is_remote=False)
+    count = index_repository(repo.id)
+
+    # first run rebuilds the stats from all commits
+    populate_author_stats(cutoff=datetime.now().astimezone())
+    assert sum(stats[3] for stats in author_stats()) == count
+
+    # only commits indexed since the last run are added
+    create_some_commit(repo.repo_url, "d1.txt")
+    create_some_commit(repo.repo_url, "d2.txt")
+    assert index_repository(repo.id) == 2
+    populate_author_stats(cutoff=datetime.now().astimezone())
+    incremental = author_stats()
+    assert sum(stats[3] for stats in incremental) == count + 2
+
+    populate_author_stats(full=True, cutoff=datetime.now().astimezone())
+    assert author_stats() == incremental
+
+    # a batch whose transaction committed after the last run, though it
+    # was stamped before it, is still counted
+    create_some_commit(repo.repo_url, "d3.txt")
+    assert index_repository(repo.id) == 1
+    late = datetime.now().astimezone() - timedelta(minutes=10)
+    Commit.objects.filter(indexed_at__gt=late).update(indexed_at=late)
+    populate_author_stats(cutoff=datetime.now().astimezone())
+    assert sum(stats[3] for stats in author_stats()) == count + 3
+
+    # the admin reads the stats from the view
+    refresh_author_stats_view()
+    total = sum(AuthorAndStat.objects.values_list("commit_count", flat=True))
+    assert total == count + 3
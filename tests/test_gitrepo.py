@@ -0,0 +1,192 @@
+import os
+import shutil
+
+import pytest
+from git import GitCommandError, Repo
+from pydriller import GitRepository
+
+from stats.analyzer import commit_modifications, get_repo_stats
+from stats.commitcache import commit_cache
+from stats.gitrepo import (
+    ReadOnlyGitRepository,
+    clear_probe_cache,
+    list_commits,
+    local_repository,
+    numstat_changes,
+    probe_repository,
+    ref_tips,
+    refs_fingerprint,
+    remote_ref_tips,
+    repository_size,
+)
+from stats.mirror import gc_mirrors, mirror_path, shared_store_path, update_mirror
+
+from .utils import create_some_commit
+
+
+def test_numstat_changes(crawler_conf):
+    git_repo = GitRepository(f"{crawler_conf['project.local']['local_path']}/repo1.git")
+    shas = [sha for sha, _ in list_commits(git_repo, ref_tips(git_repo).values(), [])]
+    assert len(shas) == 5
+
+    # numstat engine should find the same changes as pydriller
+    expected = [
+        (
+            sha,
+            sorted((m.old_path, m.new_path, m.added, m.removed, m.nloc) for m in mods),
+        )
+        for sha, mods, _ in commit_modifications(git_repo, shas, engine="pydriller")
+    ]
+    changes = [
+        (
+            sha,
+            sorted((c.old_path, c.new_path, c.added, c.removed, c.nloc) for c in mods),
+        )
+        for sha, mods in numstat_changes(git_repo, shas, nloc=True)
+    ]
+    assert changes == expected
+
+    with pytest.raises(GitCommandError, match="bad object"):
+        list(numstat_changes(git_repo, ["0" * 40]))
+
+
+def test_commit_cache(crawler_conf, settings, tmp_path):
+    repo_path = f"{crawler_conf['project.local']['local_path']}/repo1.git"
+    git_repo = GitRepository(repo_path)
+    shas = [sha for sha, _ in list_commits(git_repo, ref_tips(git_repo).values(), [])]
+    expected = get_repo_stats(repo_path).to_dict()
+    uncached = [c[:2] for c in commit_modifications(git_repo, shas, nloc=False)]
+
+    settings.COMMIT_CACHE_PATH = f"{tmp_path}/commit_cache.sqlite3"
+    assert get_repo_stats(repo_path).to_dict() == expected
+    # the analyzer filled the cache, without lines of code
+    cache = commit_cache()
+    engine = settings.COMMIT_STATS_ENGINE
+    assert cache.known(shas, engine) == set(shas)
+    assert cache.known(shas, engine, nloc=True) == set()
+    # entries of another engine are not used
+    other = "numstat" if engine == "pydriller" else "pydriller"
+    assert cache.known(shas, other) == set()
+    list(commit_modifications(git_repo, shas[:2], other))
+    assert cache.known(shas, other) == set(shas[:2])
+
+    # served from the cache, in the same order
+    cached = [c[:2] for c in commit_modifications(git_repo, shas, nloc=False)]
+    assert cached == uncached
+    assert get_repo_stats(repo_path).to_dict() == expected
+
+
+def test_read_only_git_repository(tmp_path):
+    repo = Repo.init(tmp_path / "repo")
+    (tmp_path / "repo" / "README").write_text("hello\n")
+    repo.index.add(["README"])
+    sha = repo.index.commit("first commit").hexsha
+    config = (tmp_path / "repo" / ".git" / "config").read_text()
+
+    git_repo = ReadOnlyGitRepository(str(tmp_path / "repo"))
+    assert git_repo.get_commit(sha).msg == "first commit"
+    git_repo.clear()
+    assert (tmp_path / "repo" / ".git" / "config").read_text() == config
+
+
+def test_mirror_path(settings):
+    settings.GIT_MIRROR_DIR = "/mirrors"
+    assert (
+        mirror_path("git@gitlab.com:vino9/repo.git")
+        == "/mirrors/gitlab.com/vino9/repo.git"
+    )
+    assert (
+        mirror_path("ssh://git@gitlab.com:2222/vino9/sub/repo.git")
+        == "/mirrors/gitlab.com/vino9/sub/repo.git"
+    )
+    assert mirror_path("https://github.com/../repo") == "/mirrors/github.com/repo.git"
+
+
+def test_update_mirror(crawler_conf, settings, tmp_path):
+    settings.GIT_MIRROR_DIR = f"{tmp_path}/mirrors"
+    upstream = Repo(f"{crawler_conf['project.local']['local_path']}/repo1.git")
+    upstream.git.branch("feature", "master")
+    repo_url = f"file://{upstream.working_dir}"
+
+    update = update_mirror(repo_url)
+    assert update.cloned and update.path == mirror_path(repo_url)
+    with local_repository(update.path) as git_repo:
+        assert ref_tips(git_repo) == {
+            "refs/heads/feature": upstream.heads.master.commit.hexsha,
+            "refs/heads/master": upstream.heads.master.commit.hexsha,
+        }
+
+    # branches deleted upstream are pruned
+    upstream.git.branch("-D", "feature")
+    update = update_mirror(repo_url)
+    assert not update.cloned
+    with local_repository(update.path) as git_repo:
+        assert list(ref_tips(git_repo)) == ["refs/heads/master"]
+
+    # the objects are kept once per host, in the shared store
+    assert os.listdir(os.path.join(update.path, "objects", "pack")) == []
+    store = Repo(shared_store_path("localhost"))
+    assert repository_size(store.git_dir) > 0
+
+    # a fork only downloads the objects it adds, and doesn't depend on
+    # the mirror it shares the others with
+    fork_dir = f"{os.path.dirname(upstream.working_dir)}_fork/repo1.git"
+    shutil.copytree(upstream.working_dir, fork_dir)
+    create_some_commit(fork_dir, "fork.txt")
+    fork_upstream = Repo(fork_dir)
+    fork = update_mirror(f"file://{fork_dir}")
+    assert fork.cloned
+    assert len(os.listdir(os.path.join(fork.path, "objects", "pack"))) == 0
+    # its size counts the objects it borrows
+    assert repository_size(fork.path) > 0
+    shutil.rmtree(update.path)
+    assert gc_mirrors() == ["localhost"]
+    fork_repo = Repo(fork.path)
+    fork_repo.git.fsck("--full")
+    assert fork_repo.heads.master.commit.hexsha == fork_upstream.head.commit.hexsha
+    assert len(store.git.for_each_ref("refs/mirrors/").splitlines()) == 1
+
+
+def test_probe_repository(crawler_conf, tmp_path):
+    local_path = crawler_conf["project.local"]["local_path"]
+    assert probe_repository(f"{local_path}/repo1.git")
+    assert not probe_repository(f"{local_path}/repo2.git")
+    assert not probe_repository(f"{local_path}/no_such_dir")
+
+    # a repo without commits isn't one until its first commit
+    repo = Repo.init(tmp_path / "new_repo")
+    path = str(tmp_path / "new_repo")
+    assert not probe_repository(path)
+    (tmp_path / "new_repo" / "README").write_text("hello\n")
+    repo.index.add(["README"])
+    repo.index.commit("first commit")
+    assert probe_repository(path)
+
+    # worktrees and submodules have a .git file instead of a directory
+    repo.git.worktree("add", "-b", "feature", str(tmp_path / "worktree"))
+    assert probe_repository(str(tmp_path / "worktree"))
+    (tmp_path / "worktree" / ".git").write_text("gitdir: ../no_such_dir\n")
+    assert not probe_repository(str(tmp_path / "worktree"))
+
+    # same answers without the cache
+    clear_probe_cache()
+    assert probe_repository(path)
+    assert not probe_repository(str(tmp_path / "worktree"))
+
+
+def test_refs_fingerprint(crawler_conf, settings, tmp_path):
+    settings.GIT_MIRROR_DIR = f"{tmp_path}/mirrors"
+    path = f"{crawler_conf['project.local']['local_path']}/repo1.git"
+    fingerprint = refs_fingerprint(path)
+    assert refs_fingerprint(path) == fingerprint
+
+    upstream = Repo(path)
+    upstream.git.config("user.name", "dev")
+    upstream.git.config("user.email", "dev@example.com")
+    upstream.git.tag("-a", "v1", "-m", "release")
+    assert refs_fingerprint(path) != fingerprint
+
+    # ls-remote sees the branches and tags the mirror fetches
+    mirror = update_mirror(f"file://{path}")
+    with local_repository(mirror.path) as git_repo:
+        assert remote_ref_tips(f"file://{path}") == ref_tips(git_repo)
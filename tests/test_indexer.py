@@ -1,8 +1,20 @@
+import hashlib
+import json
 import os
 import re
+import threading
+import time
+from configparser import ConfigParser
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
 import pytest
+from django.contrib.admin.sites import site
+from django.db import connection
 
+from stats.admin import RepositoryAdmin
+from stats.gitrepo import local_repository
 from stats.indexer import (
     DEFAULT_CONFIG,
     enumerate_bitbucket_projects,
@@ -10,9 +22,24 @@ from stats.indexer import (
     enumerate_gitlab_projects,
     index_repository,
     register_git_repositories,
-    repositories_for_indexing,
 )
-from stats.models import Author, ConfigEntry
+from stats.models import (
+    EPOCH_ZERO,
+    Author,
+    AuthorResolver,
+    Commit,
+    CommitRollup,
+    ConfigEntry,
+    Repository,
+)
+from stats.partitions import (
+    DEFAULT_PARTITION,
+    commit_partitions,
+    detach_commit_partitions,
+    month_of,
+    next_month,
+)
+from stats.scheduler import dispatch_indexing, plan_indexing
 
 from .utils import (
     author_count,
@@ -55,6 +82,40 @@ def test_find_author():
     assert author_count() == total
 
 
+@pytest.mark.django_db
+def test_author_resolver():
+    total = author_count()
+    authors = AuthorResolver()
+
+    # new authors are only created on flush
+    dev1 = authors.locate("dev1", "dev1@banana.com")
+    dev2 = authors.locate("dev1", "dev1@banana.org")
+    assert authors.locate("dev1", "dev1@banana.com") is dev1
+    assert author_count() == total
+    authors.flush()
+    assert author_count() == total + 2
+    assert dev1.id is not None and dev1.stats.id is not None
+
+    # alias edited outside of the resolver is picked up on next flush
+    dev2.is_alias = True
+    dev2.original = dev1
+    dev2.save()
+    assert authors.locate("dev1", "dev1@banana.org").id == dev2.id
+    authors.flush()
+    assert authors.locate("dev1", "dev1@banana.org").id == dev1.id
+    assert AuthorResolver().locate("dev1", "dev1@banana.org").id == dev1.id
+
+    # two runs meeting the same new author create a single one
+    run1, run2 = AuthorResolver(), AuthorResolver()
+    dev3 = run1.locate("dev3", "dev3@banana.com")
+    dev3_again = run2.locate("dev3", "dev3@banana.com")
+    run1.flush()
+    run2.flush()
+    assert Author.objects.filter(email="dev3@banana.com").count() == 1
+    assert dev3_again.id == dev3.id
+    assert author_count() == total + 3
+
+
 @pytest.mark.django_db
 def test_index_all_repositories(crawler_conf):
     register_git_repositories(crawler_conf)
@@ -70,6 +131,451 @@ def test_index_all_repositories(crawler_conf):
     run_index_remote_repository()
 
 
+@pytest.mark.django_db
+@pytest.mark.parametrize("workers", [1, 2])
+def test_index_local_repository(local_conf, settings, workers):
+    # small batches so that the commits are written in several transactions
+    # and computed by the process pool in several ranges
+    settings.INDEX_BATCH_SIZE = 2
+    settings.INDEX_WORKERS = workers
+    register_git_repositories(local_conf)
+
+    run_index_local_repository()
+
+    # nothing new since last run
+    repo = first_repo(is_remote=False)
+    assert "refs/heads/master" in repo.ref_bookmarks()
+    assert index_repository(repo.id) == 0
+
+    # bookmarks pointing to commits that no longer exist are ignored
+    repo.save_ref_bookmarks({"refs/heads/master": "0" * 40})
+    assert index_repository(repo.id) == 0
+
+
+@pytest.mark.django_db
+def test_skip_unchanged_repository(local_conf, tmp_path):
+    register_git_repositories(local_conf)
+    repo = first_repo(is_remote=False)
+    count = index_repository(repo.id)
+    assert count > 0
+
+    def indexed_without_walking():
+        with mock.patch(
+            "stats.indexer.local_repository", wraps=local_repository
+        ) as opened:
+            assert index_repository(repo.id) == 0
+            return not opened.called
+
+    # the refs didn't move
+    assert indexed_without_walking()
+    assert first_repo(is_remote=False).status == Repository.RepoStatus.READY
+
+    # a change of the settings commits are indexed with computes the stats
+    # of the stored commits again, once
+    def lines_added():
+        commits = Commit.objects.filter(repo=repo)
+        rollups = CommitRollup.objects.filter(repo=repo, period="day")
+        return (
+            sum(commits.values_list("lines_added", flat=True)),
+            sum(rollups.values_list("lines_added", flat=True)),
+        )
+
+    assert lines_added()[0] > 0
+    assert lines_added()[0] == lines_added()[1]
+    conf = ConfigParser()
+    conf["project.local"] = {"ignore_patterns": ".*"}
+    with open(tmp_path / "crawler.ini", "w") as f:
+        conf.write(f)
+    ConfigEntry.load(DEFAULT_CONFIG, tmp_path / "crawler.ini")
+    assert not indexed_without_walking()
+    assert lines_added() == (0, 0)
+    assert indexed_without_walking()
+
+    # commits deleted from the database are indexed again
+    Commit.objects.filter(repo=repo).delete()
+    assert index_repository(repo.id) == count
+    assert indexed_without_walking()
+
+
+@pytest.mark.django_db
+@pytest.mark.skipif(connection.vendor != "postgresql", reason="needs postgres")
+def test_commit_partitions(local_conf):
+    register_git_repositories(local_conf)
+    repo = first_repo(is_remote=False)
+    assert index_repository(repo.id) > 0
+
+    # every commit lands in the partition of its month
+    months = {
+        month_of(dt) for dt in Commit.objects.values_list("created_at", flat=True)
+    }
+    with connection.cursor() as cur:
+        assert months <= commit_partitions(cur).keys()
+        cur.execute(f"select count(*) from {DEFAULT_PARTITION}")
+        assert cur.fetchone()[0] == 0
+
+    detached = detach_commit_partitions(max(months))
+    assert len(detached) == len(months) - 1
+    assert Commit.objects.filter(created_at__lt=max(months)).count() == 0
+
+    # commits of a detached month get a new partition, not the default one
+    detached = detach_commit_partitions(next_month(max(months)))
+    assert Commit.objects.count() == 0
+    repo.refbookmark_set.all().delete()
+    Repository.objects.filter(id=repo.id).update(refs_fingerprint="")
+    assert index_repository(repo.id) > 0
+    with connection.cursor() as cur:
+        assert months <= commit_partitions(cur).keys()
+        cur.execute(f"select count(*) from {DEFAULT_PARTITION}")
+        assert cur.fetchone()[0] == 0
+
+
+@pytest.mark.django_db
+def test_index_error_backs_off(tmp_path):
+    repo = Repository.objects.create(name="broken", repo_url=f"{tmp_path}/missing")
+    assert index_repository(repo.id) == 0
+    repo.refresh_from_db()
+    assert repo.status == Repository.RepoStatus.ERROR
+    # not due again on the next run
+    assert repo.next_index_at > datetime.now().astimezone()
+
+
+@pytest.mark.django_db
+def test_reset_to_ready(tmp_path):
+    repo = Repository.objects.create(name="broken", repo_url=f"{tmp_path}/missing")
+    index_repository(repo.id)
+    assert plan_indexing() == []
+
+    # a reset repo is indexed on the next run
+    admin = RepositoryAdmin(Repository, site)
+    with mock.patch("stats.admin.messages"):
+        admin.set_ready_action(None, Repository.objects.filter(id=repo.id))
+    assert [p.repo_id for p in plan_indexing()] == [repo.id]
+
+
+@pytest.mark.django_db
+def test_plan_indexing(crawler_conf, settings, tmp_path):
+    settings.GIT_MIRROR_DIR = f"{tmp_path}/mirrors"
+    settings.INDEX_LARGE_KIB = 1
+    local_path = crawler_conf["project.local"]["local_path"]
+    now = datetime.now().astimezone()
+
+    def repo(name, commit_days, due_minutes, index_seconds, repo_url=None):
+        Repository.objects.create(
+            name=name,
+            repo_url=repo_url,
+            last_commit_at=now - timedelta(days=commit_days)
+            if commit_days is not None
+            else EPOCH_ZERO,
+            next_index_at=now - timedelta(minutes=due_minutes),
+            index_seconds=index_seconds,
+        )
+
+    repo("hot", 1, 10, 1.0)
+    repo("warm", 3, 10, 2.0)
+    repo("not_due", 1, -1, 1.0)
+    repo("dormant", 100, 1, 1.0)
+    repo("large", 1, 10, 500.0)
+    repo("larger", 1, 10, 900.0)
+    # never indexed, large enough for the large queue
+    repo("new", None, 10, None, f"{local_path}/repo1.git")
+    # never indexed, the size of a remote repo is unknown before its mirror
+    repo("new_remote", None, 10, None, "https://github.com/some/repo.git")
+    # indexed before the cost of indexing was recorded
+    repo("unmeasured", 2, 10, None)
+
+    plan = plan_indexing(now)
+    assert [p.name for p in plan] == [
+        "hot",
+        "unmeasured",
+        "warm",
+        "dormant",
+        "new_remote",
+        "new",
+        "larger",
+        "large",
+    ]
+    assert [p.queue for p in plan] == ["celery"] * 5 + ["index_large"] * 3
+
+    # repos sent to the workers are not sent again while they wait
+    assert dispatch_indexing(now) == plan
+    assert plan_indexing(now) == []
+    assert dispatch_indexing(now) == []
+
+    # nor indexed twice at the same time
+    repo = Repository.objects.get(name="hot")
+    repo.set_status(Repository.RepoStatus.INUSE)
+    assert index_repository(repo.id) == 0
+    repo.refresh_from_db()
+    assert repo.status == Repository.RepoStatus.INUSE
+
+
+@pytest.mark.django_db
+def test_schedule_next_index(settings):
+    settings.INDEX_INTERVAL = 5
+    settings.INDEX_MAX_INTERVAL = 7 * 1440
+    settings.INDEX_RECENCY_FACTOR = 0.25
+    now = datetime.now().astimezone()
+
+    def intervals(commit_age, runs):
+        repo = Repository(last_commit_at=now - commit_age)
+        result = []
+        for new_commits in runs:
+            repo.schedule_next_index(new_commits, now)
+            assert repo.next_index_at == now + repo.index_interval
+            result.append(repo.index_interval)
+        return result
+
+    # dormant for years, polled weekly from the first run
+    assert intervals(timedelta(days=1000), [100, 0]) == [timedelta(days=7)] * 2
+    # committed to an hour ago, backs off from 5 minutes up to 15
+    assert intervals(timedelta(hours=1), [3, 1, 0, 0, 0]) == [
+        timedelta(minutes=m) for m in [15, 5, 10, 15, 15]
+    ]
+    # an active repo never waits less than INDEX_INTERVAL
+    assert intervals(timedelta(0), [1, 0]) == [timedelta(minutes=5)] * 2
+
+    # with 60 commits in the last 30 days the next one is expected in 12
+    # hours, however long ago the last one was
+    settings.INDEX_RATE_DAYS = 30
+    repo = Repository.objects.create(
+        name="busy", last_commit_at=now - timedelta(days=5)
+    )
+    author = Author.locate("dev1", "dev1@banana.com")
+    for days in range(0, 30, 5):
+        CommitRollup.objects.create(
+            period=CommitRollup.Period.DAY,
+            bucket=(now - timedelta(days=days)).date(),
+            author=author,
+            repo=repo,
+            commit_count=10,
+        )
+    assert repo.mean_commit_gap(now) == timedelta(hours=12)
+    repo.schedule_next_index(0, now)
+    assert repo.index_interval == timedelta(hours=3)
+
+
+@pytest.mark.django_db
+def test_register_all():
+    def discovered(url, web_url="https://gitlab.com/$name"):
+        return {
+            "name": "group/repo",
+            "repo_url": url,
+            "repo_type": "TEST",
+            "gitweb_base_url": web_url,
+            "section": "project.remote",
+        }
+
+    # a name discovered twice keeps its first occurrence
+    url = "git@gitlab.com:group/repo.git"
+    assert Repository.register_all([discovered(url), discovered("/tmp/repo")]) == 1
+    assert Repository.register_all([discovered(url)]) == 0
+    repo = Repository.objects.get(name="group/repo")
+    assert repo.is_remote and repo.gitweb_base_url == "https://gitlab.com/group/repo"
+
+    # moved to another server
+    url = "git@github.com:group/repo.git"
+    assert Repository.register_all([discovered(url, None)]) == 0
+    repo = Repository.objects.get(name="group/repo")
+    assert repo.repo_url == url and repo.gitweb_base_url is None
+
+
+class StubGitlab(BaseHTTPRequestHandler):
+    """
+    answers the group and project listings of the GitLab API, slowly,
+    with an ETag. paths in throttle are rate limited on their first request
+    """
+
+    lock = threading.Lock()
+
+    def do_GET(self):  # noqa: N802
+        host = self.headers["Host"]
+        stats = self.server.stats
+        with self.lock:
+            stats["requests"].append(self.path)
+            if self.path in stats["throttle"]:
+                stats["throttle"].remove(self.path)
+                self.send_response(429)
+                self.send_header("Retry-After", "0")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            stats["active"][host] = stats["active"].get(host, 0) + 1
+            stats["max_active"][host] = max(
+                stats["max_active"].get(host, 0), stats["active"][host]
+            )
+            stats["max_total"] = max(stats["max_total"], sum(stats["active"].values()))
+        time.sleep(0.2)
+
+        group = self.path.split("?")[0].split("/")[4]
+        if self.path.endswith(group):
+            body = {"id": group, "full_path": group}
+        else:
+            body = [
+                {
+                    "id": i,
+                    "path_with_namespace": f"{group}/proj{i}",
+                    "ssh_url_to_repo": f"git@{host}:{group}/proj{i}.git",
+                    "web_url": f"http://{host}/{group}/proj{i}",
+                }
+                for i in range(2)
+            ]
+        data = json.dumps(body).encode()
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            stats["not_modified"] += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(data)
+        with self.lock:
+            stats["active"][host] -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_gitlab():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGitlab)
+    server.stats = {
+        "requests": [],
+        "throttle": set(),
+        "active": {},
+        "max_active": {},
+        "max_total": 0,
+        "not_modified": 0,
+    }
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+def gitlab_conf(port, groups):
+    conf = ConfigParser()
+    for group, host in groups:
+        conf[f"project.{group}"] = {
+            "type": group,
+            "group": group,
+            "gitlab_url": f"http://{host}:{port}",
+            "gitserver_type": "gitlab",
+        }
+    return conf
+
+
+@pytest.mark.django_db
+def test_concurrent_discovery(settings, stub_gitlab):
+    settings.DISCOVER_HOST_CONCURRENCY = 1
+    # two sections on one host and one on another, 127.0.0.1 and localhost
+    # are different hosts as far as the limits are concerned
+    groups = [("a", "127.0.0.1"), ("b", "127.0.0.1"), ("c", "localhost")]
+    register_git_repositories(gitlab_conf(stub_gitlab.server_address[1], groups))
+
+    names = sorted(Repository.objects.values_list("name", flat=True))
+    assert names == [f"{group}/proj{i}" for group in "abc" for i in range(2)]
+    assert set(stub_gitlab.stats["max_active"].values()) == {1}
+    assert stub_gitlab.stats["max_total"] == 2
+
+
+@pytest.mark.django_db
+def test_discovery_section_failure(stub_gitlab):
+    conf = gitlab_conf(stub_gitlab.server_address[1], [("a", "127.0.0.1")])
+    # nothing listens on port 1
+    conf["project.down"] = {
+        "group": "down",
+        "gitlab_url": "http://127.0.0.1:1",
+        "gitserver_type": "gitlab",
+    }
+    register_git_repositories(conf)
+    names = sorted(Repository.objects.values_list("name", flat=True))
+    assert names == ["a/proj0", "a/proj1"]
+
+
+@pytest.mark.django_db
+def test_discovery_http_cache(settings, stub_gitlab, tmp_path):
+    settings.HTTP_CACHE_PATH = f"{tmp_path}/http_cache.sqlite3"
+    conf = gitlab_conf(stub_gitlab.server_address[1], [("a", "127.0.0.1")])
+    stub_gitlab.stats["throttle"].add("/api/v4/groups/a")
+
+    register_git_repositories(conf)
+    # the rate limited request was retried
+    assert stub_gitlab.stats["requests"].count("/api/v4/groups/a") == 2
+    assert stub_gitlab.stats["not_modified"] == 0
+
+    # the second discovery only gets 304s, served from the cache
+    Repository.objects.all().delete()
+    register_git_repositories(conf)
+    assert stub_gitlab.stats["not_modified"] == 2
+    names = sorted(Repository.objects.values_list("name", flat=True))
+    assert names == ["a/proj0", "a/proj1"]
+
+
+class StubGithub(BaseHTTPRequestHandler):
+    """answers the repository search of the GitHub API, in pages of two"""
+
+    def do_GET(self):  # noqa: N802
+        host = self.headers["Host"]
+        self.server.requests.append((self.path, self.headers["Authorization"]))
+        page = 2 if "page=2" in self.path else 1
+        body = {
+            "total_count": 3,
+            "items": [
+                {
+                    "full_name": f"user/proj{i}",
+                    "git_url": f"git://github.com/user/proj{i}.git",
+                    "html_url": f"http://{host}/user/proj{i}",
+                }
+                for i in ([0, 1] if page == 1 else [2])
+            ],
+        }
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if page == 1:
+            next_page = f"http://{host}/search/repositories?q=user%3Auser&page=2"
+            self.send_header("Link", f'<{next_page}>; rel="next"')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.mark.django_db
+def test_enumerate_github_stub():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGithub)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host = f"127.0.0.1:{server.server_address[1]}"
+    conf = ConfigParser()
+    conf["project.github"] = {
+        "query": "user:user",
+        "github_url": f"http://{host}",
+        "access_token": "secret",
+        "filter": "user/proj[12]",
+        "gitserver_type": "github",
+    }
+    try:
+        # every page is read through the shared session
+        projs = enumerate_github_projects(conf["project.github"])
+        assert [p["full_name"] for p in projs] == ["user/proj1", "user/proj2"]
+        assert [auth for _, auth in server.requests] == ["token secret"] * 2
+        assert server.requests[0][0].startswith("/search/repositories?q=user")
+
+        register_git_repositories(conf)
+        repo = Repository.objects.get(name="user/proj1")
+        assert repo.repo_url == "git@github.com:user/proj1.git"
+        assert repo.gitweb_base_url == f"http://{host}/user/proj1"
+    finally:
+        server.shutdown()
+
+
 def test_enumerate_gitlab_projects(crawler_conf):
     projs = enumerate_gitlab_projects(crawler_conf["project.remote"])
     assert len(projs) == 2
@@ -88,14 +594,18 @@ def test_enumerate_bitbucket_projects(crawler_conf):
 
 def test_enumerate_github_projects(crawler_conf):
     projs = enumerate_github_projects(crawler_conf["project.github"])
-    names = [p.full_name for p in projs]
+    names = [p["full_name"] for p in projs]
     assert len(projs) == 2
     assert "sloppycoder/bank-demo-app" in names
 
 
+def due_repositories():
+    return Repository.objects.filter(id__in=[p.repo_id for p in plan_indexing()])
+
+
 def run_scan_repositories():
     count = 0
-    for repo in repositories_for_indexing():
+    for repo in due_repositories():
         web_url = repo.gitweb_base_url
         print(f"{repo.name} => {repo.repo_url}, {web_url}")
         assert web_url is not None
@@ -136,5 +646,5 @@ def test_index_all():
     if os.getenv("RUN_RUN_RUN") == "run":
         ConfigEntry.load(DEFAULT_CONFIG, "crawler/crawler.ini")
         register_git_repositories()
-        for repo in repositories_for_indexing():
+        for repo in due_repositories():
             index_repository(repo.id)
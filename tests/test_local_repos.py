@@ -1,6 +1,8 @@
+import json
+import shutil
 from configparser import ConfigParser
 
-from stats.analyzer import analyze_all_repositories
+from stats.analyzer import RepoStats, analyze_all_repositories
 
 
 def test_local_repos(crawler_conf):
@@ -9,6 +11,68 @@ def test_local_repos(crawler_conf):
     assert stats is not None
 
 
+def test_analyze_streaming(local_conf, tmp_path):
+    report = f"{tmp_path}/stats"
+    assert analyze_all_repositories(report, local_conf) == 1
+
+    with open(f"{report}.ndjson") as f:
+        partial = f.read()
+    with open(f"{report}.json") as f:
+        stats = json.load(f)
+    assert len(stats) == 1
+    repo_stats = list(stats.values())[0]
+    assert repo_stats["commits"]["total"]["count"] > 0
+    with open(f"{report}.csv") as f:
+        lines = f.readlines()
+    assert len(lines) > 1 and all(line.count(",") == 4 for line in lines)
+
+    # resume after a crash in the middle of writing the stats of a repo
+    with open(f"{report}.ndjson", "a") as f:
+        f.write('{"repo": "half written')
+    assert analyze_all_repositories(report, local_conf, resume=True) == 0
+    with open(f"{report}.ndjson") as f:
+        assert f.read() == partial
+    with open(f"{report}.json") as f:
+        assert json.load(f) == stats
+
+
+def test_analyze_in_parallel(local_conf, tmp_path):
+    shutil.copytree(tmp_path / "repo1.git", tmp_path / "repo3.git")
+    report = f"{tmp_path}/stats"
+
+    progress = []
+    count = analyze_all_repositories(
+        report,
+        local_conf,
+        workers=2,
+        progress=lambda done, total, eta: progress.append((done, total)),
+    )
+    assert count == 2
+    assert progress == [(1, 2), (2, 2)]
+    with open(f"{report}.json") as f:
+        stats = list(json.load(f).values())
+    assert stats[0] == stats[1]
+
+
+def test_repo_stats_merge():
+    part1, part2 = RepoStats(), RepoStats()
+    part1.add_commit(is_merge=False)
+    part1.add_file("src", ".py", 10, 2)
+    part2.add_commit(is_merge=True)
+    part2.add_commit(is_merge=False)
+    part2.add_file("src", ".py", 1, 1)
+    part2.add_file("/", "", 3, 0)
+
+    assert part1.merge(part2).to_dict() == {
+        "commits": {"total": {"count": 3}, "merge": {"count": 1}},
+        "base_path": {"src": {"count": 2}, "/": {"count": 1}},
+        "ext": {
+            ".py": {"count": 2, "added": 11, "removed": 3},
+            "": {"count": 1, "added": 3, "removed": 0},
+        },
+    }
+
+
 def local_ini():
     parser = ConfigParser()
     parser.read_string(
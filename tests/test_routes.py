@@ -1,8 +1,48 @@
 import pytest
 
+from stats.indexer import index_repository, register_git_repositories
+from stats.models import Author
+from stats.rollups import rebuild_author_rollups, rebuild_commit_rollups
+
+from .utils import first_repo
+
 
 @pytest.mark.django_db
 def test_stats_endpoints(client):
     response = client.get("/stats/repo?code=s3cr3t")
     assert response.status_code == 200
     assert isinstance(response.json(), list)
+
+
+@pytest.mark.django_db
+def test_rollup_endpoint(client, local_conf):
+    register_git_repositories(local_conf)
+    count = index_repository(first_repo(is_remote=False).id)
+
+    response = client.get("/stats/rollup?code=s3cr3t&period=month&group_by=author")
+    assert response.status_code == 200
+    rows = response.json()
+    assert sum(row["commit_count"] for row in rows) == count
+    assert all(row["bucket"].endswith("-01") and row["author"] for row in rows)
+
+    # rollups maintained while indexing match the ones rebuilt from commits
+    for period in ["day", "week", "month"]:
+        url = f"/stats/rollup?code=s3cr3t&period={period}&group_by=repo,author"
+        indexed = client.get(url).json()
+        rebuild_commit_rollups()
+        assert client.get(url).json() == indexed
+
+    # the commits of an alias are moved to its original
+    url = "/stats/rollup?code=s3cr3t&period=month&group_by=author"
+    alias, original = Author.objects.order_by("id")[:2]
+    alias.is_alias, alias.original = True, original
+    alias.save()
+    rebuild_author_rollups([alias.id, original.id])
+    rows = client.get(url).json()
+    assert {row["author"] for row in rows} == {original.email}
+    assert sum(row["commit_count"] for row in rows) == count
+    rebuild_commit_rollups()
+    assert client.get(url).json() == rows
+
+    response = client.get("/stats/rollup?code=s3cr3t&period=year")
+    assert response.status_code == 400
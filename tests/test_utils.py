@@ -1,6 +1,7 @@
 import os
+from configparser import ConfigParser
 
-from stats.utils import is_remote_git_url, should_ignore_path
+from stats.utils import ShaSet, ignore_matcher, is_remote_git_url, should_ignore_path
 
 
 def test_ignore_patterns():
@@ -53,3 +54,35 @@ def test_git_repo_patterns():
     assert not is_remote_git_url("git@gitlab.com:user/repo")
     # local file path is not remote
     assert not is_remote_git_url("some/local/path.git")
+
+
+def test_sha_set():
+    shas = ShaSet(["224cf3139ddc757f67b384034bad85554d693d27"])
+    assert "224cf3139ddc757f67b384034bad85554d693d27" in shas
+    assert "144afc78bb0f5f754fecc7ecb50f4f99f84579b4" not in shas
+    shas.add("144afc78bb0f5f754fecc7ecb50f4f99f84579b4")
+    assert "144afc78bb0f5f754fecc7ecb50f4f99f84579b4" in shas
+    assert len(shas) == 2
+
+
+def test_ignore_matcher_by_section():
+    conf = ConfigParser()
+    conf.read_string(
+        """
+[project.custom]
+ignore_patterns =
+    ^docs/
+    .*\\.min\\.js$
+
+[project.plain]
+type = TEST
+"""
+    )
+    matcher = ignore_matcher(conf["project.custom"])
+    assert matcher.match("docs/index.md")
+    assert matcher.match("static/app.min.js")
+    assert not matcher.match("vendor/librar/stuff/blah.go")
+
+    # sections without ignore_patterns use the default patterns
+    assert ignore_matcher(conf["project.plain"]) is ignore_matcher()
+    assert ignore_matcher(conf["project.plain"]).match("vendor/librar/stuff/blah.go")